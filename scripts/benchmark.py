@@ -0,0 +1,256 @@
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+
+from typing import Callable
+
+import check
+import generate_html
+import generate_markdown
+import generate_mermaid
+import generate_spritesheets
+import generate_snapshot
+import generate_sqlite
+from pokemon_data import cache_dir, schemas_base_path, load_json, load_groups, load_types, load_snapshot, iter_groups, pkmn_index, pkmn_evolutions
+
+
+default_output = os.path.join(cache_dir, 'benchmarks.json')
+icon_dirs = ['sprites/common/icons', 'sprites/shiny/icons']
+
+
+def scale_group(data: dict, copy: int, offset: int) -> dict :
+    # Copies keep the same forms and sprites, with numbers (and evolutions) shifted by a multiple of the dataset size
+    res = dict(data)
+    res['number'] = data['number'] + copy * offset
+    if data['evolves_from'] is not None :
+        res['evolves_from'] = data['evolves_from'] + copy * offset
+    if copy > 0 :
+        res['forms'] = [{ **x, 'names': { lang: f"{name} {copy}" for lang, name in x['names'].items() } } for x in data['forms']]
+    return res
+
+def make_dataset(root: str, source: str, scale: int):
+    # Synthetic tree with the layout of the repository, sprites are linked rather than copied
+    groups = load_json(os.path.join(source, 'pokemon.json'))
+    offset = max(x['number'] for x in groups)
+    with open(os.path.join(root, 'pokemon.json'), 'w') as f:
+        json.dump([scale_group(x, copy, offset) for copy in range(scale) for x in groups], f)
+    shutil.copy(os.path.join(source, 'types.json'), root)
+    shutil.copytree(os.path.join(source, schemas_base_path), os.path.join(root, schemas_base_path))
+    os.makedirs(os.path.join(root, 'sprites'))
+    for name in ['types', 'unknown.png'] :
+        os.symlink(os.path.join(source, 'sprites', name), os.path.join(root, 'sprites', name))
+    for directory in icon_dirs :
+        os.makedirs(os.path.join(root, directory))
+        for filename in os.listdir(os.path.join(source, directory)) :
+            number, suffix = filename[:4], filename[4:]
+            for copy in range(scale) :
+                os.symlink(os.path.join(source, directory, filename), os.path.join(root, directory, f"{int(number) + copy * offset:04d}{suffix}"))
+
+
+def setup_load_cold() -> Callable :
+    shutil.rmtree('.cache', ignore_errors=True)
+    return load_groups
+
+def setup_load_cached() -> Callable :
+    load_groups()
+    return load_groups
+
+def setup_load_snapshot() -> Callable :
+    # Opening the snapshot and reading every form, the equivalent of a cold load_groups in a worker
+    generate_snapshot.generate(load_groups(), load_types())
+    return lambda: sum(len(form.names.en) for group in load_snapshot() for form in group.forms)
+
+def setup_iter_groups() -> Callable :
+    load_groups()
+    return lambda: sum(1 for _ in iter_groups())
+
+def setup_check() -> Callable :
+    groups = load_groups()
+    return lambda: check.check_pokemon_groups(pkmn_index(groups), check.sprite_inventory(), check.error_logger())
+
+def setup_spritesheets() -> Callable :
+    # Copies of the dataset share their pixels, deduplication would hide the growth of the sheets
+    groups = load_groups()
+    types = list(load_types().keys())
+    return lambda: generate_spritesheets.generate(groups, types, generate_spritesheets.parse_args(['--force', '--no-dedup']))
+
+def setup_html() -> Callable :
+    groups = load_groups()
+    types = list(load_types().keys())
+    return lambda: generate_html.generate(groups, types, generate_html.parse_args([]))
+
+def setup_markdown() -> Callable :
+    groups = load_groups()
+    types = list(load_types().keys())
+    return lambda: generate_markdown.generate(groups, types)
+
+def setup_mermaid() -> Callable :
+    groups = load_groups()
+    return lambda: generate_mermaid.generate(pkmn_evolutions(pkmn_index(groups)))
+
+def setup_sqlite() -> Callable :
+    groups = load_groups()
+    types = load_types()
+    return lambda: generate_sqlite.generate(groups, types, True)
+
+def setup_snapshot() -> Callable :
+    groups = load_groups()
+    types = load_types()
+    return lambda: generate_snapshot.generate(groups, types, True)
+
+benchmarks: dict[str, Callable[[], Callable]] = {
+    'load-cold': setup_load_cold,
+    'load-cached': setup_load_cached,
+    'load-snapshot': setup_load_snapshot,
+    'iter-groups': setup_iter_groups,
+    'check': setup_check,
+    'spritesheets': setup_spritesheets,
+    'html': setup_html,
+    'markdown': setup_markdown,
+    'mermaid': setup_mermaid,
+    'sqlite': setup_sqlite,
+    'snapshot': setup_snapshot
+}
+
+
+def memory_status() -> dict[str, int] :
+    res = {}
+    if os.path.isfile('/proc/self/status') :
+        with open('/proc/self/status', 'r') as f:
+            for line in f :
+                if line.startswith(('VmHWM:', 'VmRSS:')) :
+                    res[line.split(':')[0]] = int(line.split()[1])
+    return res
+
+def reset_peak_rss():
+    # Linux only, elsewhere the peak also covers the setup of the benchmark
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def run_benchmark(name: str, connection):
+    # Each benchmark runs in its own process, so that its peak memory is not hidden by the previous ones
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    run = benchmarks[name]()
+    reset_peak_rss()
+    start_rss = memory_status().get('VmRSS', 0)
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    run()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    peak_rss = memory_status().get('VmHWM', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    sys.stdout.flush()
+    connection.send({ 'seconds': wall, 'cpu_seconds': cpu, 'peak_rss_kb': peak_rss, 'rss_growth_kb': peak_rss - start_rss })
+    connection.close()
+
+def measure(name: str) -> dict | None :
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_benchmark, args=(name, sender))
+    process.start()
+    sender.close()
+    try:
+        res = receiver.recv()
+    except EOFError:
+        res = None
+    process.join()
+    return res
+
+
+def compare(results: dict, previous: dict, threshold: float, min_seconds: float) -> list[str] :
+    regressions = []
+    for name, scales in results['results'].items() :
+        for scale, res in scales.items() :
+            old = previous.get('results', {}).get(name, {}).get(scale)
+            if old is None or res is None :
+                continue
+            if res['seconds'] > old['seconds'] * threshold and res['seconds'] - old['seconds'] > min_seconds :
+                regressions.append(f"{name} at {scale}x: {old['seconds']:.3f}s -> {res['seconds']:.3f}s")
+            if res['rss_growth_kb'] > old['rss_growth_kb'] * threshold and res['rss_growth_kb'] - old['rss_growth_kb'] > 10240 :
+                regressions.append(f"{name} at {scale}x: memory {old['rss_growth_kb']} KB -> {res['rss_growth_kb']} KB")
+    return regressions
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Times the loaders and generators on the data and on synthetic datasets scaled from it')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help='dataset sizes as multiples of the current data (default: 1 10)')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks.keys()), metavar='NAME', help=f"benchmarks to run (default: all, among {', '.join(benchmarks.keys())})")
+    parser.add_argument('--max-sheet-scale', type=int, default=10, help='largest scale at which spritesheets are generated, as every sheet is assembled in memory (default: 10)')
+    parser.add_argument('-o', '--output', default=default_output, help=f"file in which the results are saved (default: {default_output})")
+    parser.add_argument('--compare', metavar='PATH', help='previous results to compare with, regressions make the script fail')
+    parser.add_argument('--threshold', type=float, default=1.25, help='ratio over the previous results reported as a regression (default: 1.25)')
+    args = parser.parse_args(argv)
+
+    source = os.getcwd()
+    output = os.path.abspath(args.output)
+    previous = load_json(args.compare) if args.compare is not None else None
+    names = args.only if args.only is not None else list(benchmarks.keys())
+    results: dict = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'scales': args.scales,
+        'results': { x: {} for x in names }
+    }
+
+    for scale in args.scales :
+        with tempfile.TemporaryDirectory(prefix=f"pokemon-bench-{scale}x-") as root:
+            start = time.perf_counter()
+            make_dataset(root, source, scale)
+            print(f"Dataset at {scale}x built in {time.perf_counter() - start:.2f}s")
+            os.chdir(root)
+            try:
+                for name in names :
+                    if name == 'spritesheets' and scale > args.max_sheet_scale :
+                        continue
+                    res = measure(name)
+                    results['results'][name][str(scale)] = res
+                    if res is None :
+                        print(f"  {name:<14} failed")
+                    else:
+                        print(f"  {name:<14} {res['seconds']:>9.3f}s {res['cpu_seconds']:>9.3f}s CPU {res['rss_growth_kb'] / 1024:>9.1f} MB")
+            finally:
+                os.chdir(source)
+
+    # Time per unit of data relative to the smallest scale, values well above 1 indicate superlinear behaviour
+    base_scale = str(min(args.scales))
+    print(f"{'Benchmark':<14} " + ' '.join(f"{f'{x}x':>8}" for x in args.scales))
+    for name, scales in results['results'].items() :
+        base = scales.get(base_scale)
+        cells = []
+        for scale in args.scales :
+            res = scales.get(str(scale))
+            if res is None or base is None or base['seconds'] == 0 :
+                cells.append(f"{'-':>8}")
+            else:
+                cells.append(f"{res['seconds'] / base['seconds'] * int(base_scale) / scale:>8.2f}")
+        print(f"{name:<14} " + ' '.join(cells))
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved at {output}")
+
+    if previous is not None :
+        regressions = compare(results, previous, args.threshold, 0.05)
+        for regression in regressions :
+            print(f"Regression: {regression}")
+        if len(regressions) > 0 :
+            return 1
+        print(f"No regression compared to {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
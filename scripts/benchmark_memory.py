@@ -0,0 +1,81 @@
+import gc
+import sys
+import tracemalloc
+
+from pokemon_data import load_validated_json, pkmn_gender_ratio, pkmn_group
+
+
+# Dict-backed model as it existed before the compact representation, kept for comparison
+class legacy_names:
+    def __init__(self, data):
+        self.fr: str = data['fr']
+        self.en: str = data['en']
+
+class legacy_links:
+    def __init__(self, data):
+        self.bulbapedia: str = data['bulbapedia']
+        self.pokepedia: str = data['pokepedia']
+
+class legacy_derivation:
+    def __init__(self, data):
+        self.from_variants: list[str | None] = data['from']
+        self.battle_only: bool = data['battle_only']
+
+class legacy_form:
+    def __init__(self, data):
+        self.names = legacy_names(data['names'])
+        self.links = legacy_links(data['links'])
+        self.types: list[str] = data['types']
+        self.gen: int = data['gen']
+        self.variant: str | None = data['variant'] if 'variant' in data else None
+        self.evolution_variants: list[str] | None = data['evolution_variants'] if 'evolution_variants' in data else None
+        self.gender_variant: bool = data['gender_variant'] if 'gender_variant' in data else False
+        self.gender_ratio = pkmn_gender_ratio(data['gender_ratio']) if 'gender_ratio' in data and data['gender_ratio'] is not None else None
+        self.derives: legacy_derivation | None = None
+        if 'derives' in data and data['derives'] is not None :
+            self.derives = legacy_derivation(data['derives'])
+
+class legacy_group:
+    def __init__(self, data):
+        self.number: int = data['number']
+        self.common_names: legacy_names | None = None
+        if 'common_names' in data and data['common_names'] is not None :
+            self.common_names = legacy_names(data['common_names'])
+        self.evolves_from: int | None = data['evolves_from']
+        self.forms: list[legacy_form] = list(legacy_form(x) for x in data['forms'])
+
+
+def measure(group_class) -> tuple[int, int] :
+    # The raw JSON is parsed inside the measurement and then dropped,
+    # so that only the memory retained by the model is reported
+    gc.collect()
+    tracemalloc.start()
+    data = load_validated_json('pokemon.json')
+    groups = list(group_class(x) for x in data)
+    del data
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del groups
+    return retained, peak
+
+
+def main() -> int :
+    # Warm-up, so that the validation cache and lazily imported modules do not skew the first measurement
+    load_validated_json('pokemon.json')
+
+    form_count = sum(len(x['forms']) for x in load_validated_json('pokemon.json'))
+    results = {
+        'legacy': measure(legacy_group),
+        'compact': measure(pkmn_group)
+    }
+    print(f"{'Model':<10} {'Retained':>12} {'Per form':>10} {'Peak':>12}")
+    for name, (retained, peak) in results.items():
+        print(f"{name:<10} {retained:>12,} {retained // form_count:>10,} {peak:>12,}")
+    saved = results['legacy'][0] - results['compact'][0]
+    print(f"Compact model saves {saved:,} bytes ({saved / results['legacy'][0]:.1%}) over {form_count} forms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
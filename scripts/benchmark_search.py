@@ -0,0 +1,66 @@
+import sys
+import time
+import random
+
+from pokemon_data import load_groups, normalize_name, pkmn_group, pkmn_search_index
+
+
+# Linear scan over all the names, as done by consumers before the search index, kept for comparison
+def linear_prefix(groups: list[pkmn_group], query: str, limit: int = 10) -> list[tuple[int, str | None]] :
+    key = normalize_name(query)
+    res = []
+    for group in groups :
+        for form in group.forms :
+            if any(normalize_name(x).startswith(key) for x in [form.names.en, form.names.fr]) :
+                res.append((group.number, form.variant))
+                if len(res) >= limit :
+                    return res
+    return res
+
+
+def make_queries(groups: list[pkmn_group], count: int) -> tuple[list[str], list[str]] :
+    rng = random.Random(42)
+    names = [x for group in groups for form in group.forms for x in [form.names.en, form.names.fr]]
+    prefixes = []
+    typos = []
+    for _ in range(count) :
+        name = rng.choice(names)
+        prefixes.append(name[:rng.randint(1, min(len(name), 6))])
+        pos = rng.randrange(len(name))
+        typos.append(name[:pos] + rng.choice('aeiourstn') + name[pos+1:])
+    return prefixes, typos
+
+def measure(run, queries: list[str]) -> tuple[float, float, float] :
+    latencies = []
+    start = time.perf_counter()
+    for query in queries :
+        query_start = time.perf_counter()
+        run(query)
+        latencies.append(time.perf_counter() - query_start)
+    total = time.perf_counter() - start
+    latencies.sort()
+    return len(queries) / total, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main() -> int :
+    groups = load_groups()
+    start = time.perf_counter()
+    index = pkmn_search_index(groups)
+    print(f"Index built in {(time.perf_counter() - start) * 1000:.1f} ms over {len(index.keys)} forms")
+
+    prefixes, typos = make_queries(groups, 2000)
+    results = {
+        'linear prefix': measure(lambda x: linear_prefix(groups, x), prefixes[:200]),
+        'trie prefix': measure(index.prefix, prefixes),
+        'fuzzy': measure(index.fuzzy, typos),
+        'search (prefix)': measure(index.search, prefixes),
+        'search (typo)': measure(index.search, typos)
+    }
+    print(f"{'Query':<16} {'QPS':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for name, (qps, p50, p99) in results.items():
+        print(f"{name:<16} {qps:>10,.0f} {p50 * 1000:>10.3f} {p99 * 1000:>10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
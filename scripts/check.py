@@ -1,24 +1,35 @@
 
 import os
 import sys
+import json
+import hashlib
+import argparse
 
-from pokemon_data import load_groups, load_types, pkmn_group, pkmn_form
+import instrumentation
+from instrumentation import open_file, stage
+from pokemon_data import atomic_write, cache_dir, load_json, load_types, load_validated_json, schemas_digest, validate_groups, group_validation_error, pkmn_group, pkmn_form, pkmn_index, pkmn_evolutions
+from pokemon_sprites import form_sprite_filenames
+import pokemon_data
+import pokemon_sprites
 
 
 class error_logger :
     def __init__(self):
         self.has_error: bool = False
         self.print_num: bool = True
-        self.num: int = 0
+        self.section: str = ''
 
-    def start_group(self, number: int):
-        self.num = number
+    def start_section(self, title: str):
+        self.section = title
         self.print_num = False
 
+    def start_group(self, number: int):
+        self.start_section(f"Group #{number:04d}")
+
     def error(self, message: str):
         self.has_error = True
         if not self.print_num :
-            print(f"===== Group #{self.num:04d} ==========================")
+            print(f"===== {self.section} ==========================")
             self.print_num = True
         print(f"ERR: {message}")
     
@@ -26,37 +37,79 @@ class error_logger :
         return not self.has_error
 
 
-def check_sprite_files(filename: str, logger: error_logger):
-    common_icon_path = os.path.join('sprites/common/icons', filename)
-    shiny_icon_path = os.path.join('sprites/shiny/icons', filename)
-    if not os.path.isfile(common_icon_path) :
-        logger.error(f"Common icon not found in {common_icon_path}")
-    if not os.path.isfile(shiny_icon_path) :
-        logger.error(f"Shiny icon not found in {shiny_icon_path}")
-
-def check_pokemon_sprites(group: pkmn_group, form: pkmn_form, logger: error_logger):
-    group_id = f"{group.number:04d}"
-    if form.gender_variant :
-        sprite_files = [f"{group_id}_f", f"{group_id}_m"]
-    else:
-        sprite_files = [f"{group_id}"]
-    if form.variant is not None :
-        sprite_files = [f"{x}_{form.variant}" for x in sprite_files]
-    sprite_files = [f"{x}.png" for x in sprite_files]
-    for filename in sprite_files:
-        check_sprite_files(filename, logger)
-
-def check_pokemon_groups(pokemon_data: list[pkmn_group], logger: error_logger):
+icon_dirs = {
+    'Common': 'sprites/common/icons',
+    'Shiny': 'sprites/shiny/icons'
+}
+types_sprites_dir = 'sprites/types'
+languages = ['en', 'fr']
+
+def list_files(directory: str) -> set[str] :
+    if not os.path.isdir(directory) :
+        return set()
+    return { x.name for x in os.scandir(directory) if x.is_file() }
+
+class sprite_inventory :
+    def __init__(self):
+        # Each directory is listed once, existence checks are then done in memory
+        self.files: dict[str, set[str]] = { kind: list_files(directory) for kind, directory in icon_dirs.items() }
+        self.referenced: set[str] = set()
+
+def check_sprite_files(filename: str, inventory: sprite_inventory, logger: error_logger):
+    inventory.referenced.add(filename)
+    for kind, directory in icon_dirs.items() :
+        if filename not in inventory.files[kind] :
+            logger.error(f"{kind} icon not found in {os.path.join(directory, filename)}")
+
+def check_orphan_sprites(inventory: sprite_inventory, logger: error_logger):
+    logger.start_section('Orphan sprites')
+    for kind, directory in icon_dirs.items() :
+        for filename in sorted(inventory.files[kind] - inventory.referenced) :
+            logger.error(f"{kind} icon {os.path.join(directory, filename)} is not used by any form")
+
+def check_type_sprites(type_ids: list[str], logger: error_logger):
+    logger.start_section('Type sprites')
+    # The expected sprites are the ones found for any type, so that every type provides the same set
+    type_files: dict[str, set[str]] = {}
+    for typ in type_ids :
+        type_dir = os.path.join(types_sprites_dir, typ)
+        type_files[typ] = list_files(type_dir)
+        for lang in languages :
+            type_files[typ].update(f"{lang}/{x}" for x in list_files(os.path.join(type_dir, lang)))
+    expected = set().union(*type_files.values())
+    for typ, files in type_files.items() :
+        for filename in sorted(expected - files) :
+            logger.error(f"Type sprite not found in {os.path.join(types_sprites_dir, typ, filename)}")
+    # Text sprites must also be available in every language
+    lang_files = { lang: { x[len(lang)+1:] for x in expected if x.startswith(f"{lang}/") } for lang in languages }
+    all_lang_files = set().union(*lang_files.values())
+    for lang, files in lang_files.items() :
+        for filename in sorted(all_lang_files - files) :
+            logger.error(f"Type sprite {filename} is not available in language {lang}")
+    if os.path.isdir(types_sprites_dir) :
+        for entry in sorted(os.scandir(types_sprites_dir), key=lambda x: x.name) :
+            if entry.name not in type_files :
+                logger.error(f"Type sprites found for unknown type {entry.name} in {entry.path}")
+
+def check_pokemon_sprites(group: pkmn_group, form: pkmn_form, inventory: sprite_inventory, logger: error_logger):
+    for filename in form_sprite_filenames(group.number, form):
+        check_sprite_files(filename, inventory, logger)
+
+def check_pokemon_groups(index: pkmn_index, inventory: sprite_inventory, logger: error_logger, only: set[int] | None = None):
+    # When only is provided, the checks specific to a group are restricted to these groups,
+    # whereas the checks on the whole list (ordering, sprites) are always performed
+    groups = index.groups
+    evolutions = pkmn_evolutions(index)
     last_number: int | None = None
-    all_groups: dict[int, pkmn_group] = {}
-    for group in pokemon_data:
+    for group in groups:
         logger.start_group(group.number)
-        if group.number in all_groups :
+        if index.group(group.number) is not group :
             logger.error(f"Group {group.number} was found several times)")
         if last_number is not None and last_number+1 != group.number :
             logger.error(f"Group {group.number} is misplaced (previous is {last_number})")
         last_number = group.number
-        all_groups[group.number] = group
+        if only is not None and group.number not in only :
+            continue
         known_variants: list[str | None] = []
         for form in group.forms :
             if form.variant is None and form.derives is not None :
@@ -76,16 +129,19 @@ def check_pokemon_groups(pokemon_data: list[pkmn_group], logger: error_logger):
                 logger.error(f"First form in group (with variant {group.forms[0].variant}) cannot derive other forms")
             if group.forms[0].is_temporary() :
                 logger.error(f"First form in group (with variant {group.forms[0].variant}) cannot be battle-only")
-    for group in pokemon_data:
+    for group in groups:
         logger.start_group(group.number)
+        if only is not None and group.number not in only :
+            for form in group.forms :
+                check_pokemon_sprites(group, form, inventory, logger)
+            continue
         pre_evolution: pkmn_group | None = None
-        if group.evolves_from is not None :
-            if group.evolves_from in all_groups :
-                pre_evolution = all_groups[group.evolves_from]
-            else:
-                logger.error(f"Group {group.number} evolves from unknown group {group.evolves_from}")
+        if group.number in evolutions.unknown :
+            logger.error(f"Group {group.number} evolves from unknown group {group.evolves_from}")
+        elif evolutions.parent(group.number) is not None :
+            pre_evolution = index.group(evolutions.parent(group.number))
         for form in group.forms :
-            check_pokemon_sprites(group, form, logger)
+            check_pokemon_sprites(group, form, inventory, logger)
             if form.evolution_variants is not None :
                 if form.derives is not None :
                     logger.error(f"Found evolution variant {form.evolution_variants} for derived group")
@@ -97,19 +153,18 @@ def check_pokemon_groups(pokemon_data: list[pkmn_group], logger: error_logger):
                         pre_form = pre_evolution.find_form(evolution_variants)
                         if pre_form is None :
                             logger.error(f"Evolution variant {evolution_variants} does not exist in pre-evolution group {pre_evolution.number}")
+                            continue
                         if pre_form.derives is not None :
                             logger.error(f"Evolution variant {evolution_variants} in pre-evolution group {pre_evolution.number} refers to a derived form")
             elif pre_evolution is not None :
-                pre_form = pre_evolution.find_form(form.variant)
-                if pre_form is None:
+                pre_variants = evolutions.pre_evolution_variants(group, form)
+                if len(pre_variants) == 0 :
                     if form.variant is None :
                         logger.error(f"Pre-evolution group {pre_evolution.number} does not have a default variant to evolve")
-                        continue
                     else:
-                        pre_form = pre_evolution.find_form(None)
-                        if pre_form is None :
-                            logger.error(f"Pre-evolution group {pre_evolution.number} does not have a {form.variant} variant to evolve, nor a default variant")
-                            continue
+                        logger.error(f"Pre-evolution group {pre_evolution.number} does not have a {form.variant} variant to evolve, nor a default variant")
+                    continue
+                pre_form = pre_evolution.find_form(pre_variants[0])
                 if pre_form.derives is not None :
                     if pre_form.variant is None :
                         logger.error(f"Default evolution variant in pre-evolution group {pre_evolution.number} refers to a derived form")
@@ -119,7 +174,13 @@ def check_pokemon_groups(pokemon_data: list[pkmn_group], logger: error_logger):
                 logger.error(f"Missing gender ratio for non-derived form {form.variant}")
             if form.gender_variant and (form.gender_ratio is None or not form.gender_ratio.is_mixed()) :
                 logger.error(f"Found gender variant for form {form.variant} with non-mixed gender ratio {form.gender_ratio}")
-    for group in pokemon_data :
+    for cycle in evolutions.cycles :
+        # Loops are always looked for, a change in any group of the loop can close it
+        logger.start_group(cycle[0])
+        logger.error(f"Evolution loop between groups {' -> '.join(str(x) for x in cycle)}")
+    for group in groups :
+        if only is not None and group.number not in only :
+            continue
         logger.start_group(group.number)
         for form in group.forms :
             if form.derives is not None :
@@ -137,7 +198,93 @@ def check_pokemon_groups(pokemon_data: list[pkmn_group], logger: error_logger):
                     if derived_form.is_temporary() and not form.is_temporary() :
                         logger.error(f"Permanent variant {form.variant} derives from battle-only variant {derived_variant}")
 
-def main() -> int :
+def check_all(groups: list[pkmn_group], type_ids: list[str], logger: error_logger, only: set[int] | None = None):
+    with stage('inventory'):
+        inventory = sprite_inventory()
+    with stage('groups'):
+        check_pokemon_groups(pkmn_index(groups), inventory, logger, only)
+    with stage('orphan sprites'):
+        check_orphan_sprites(inventory, logger)
+    with stage('type sprites'):
+        check_type_sprites(type_ids, logger)
+
+def report_validation_errors(error: group_validation_error, logger: error_logger):
+    for idx, number, messages in error.errors :
+        if number is not None :
+            logger.start_group(number)
+        else:
+            logger.start_section(f"Group at index {idx}")
+        for message in messages :
+            logger.error(message)
+
+
+check_cache_path = os.path.join(cache_dir, 'check.json')
+
+def group_fingerprint(data) -> str :
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def rules_digest() -> str :
+    # The results depend on the data of the types, the schemas and the rules implemented here and in the modules used by them
+    digest = hashlib.sha256(schemas_digest().encode())
+    for path in ['types.json', __file__, pokemon_data.__file__, pokemon_sprites.__file__] :
+        with open_file(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def load_check_cache(rules: str) -> dict[str, str] :
+    try:
+        cache = load_json(check_cache_path)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('rules') != rules :
+        return {}
+    return cache['groups']
+
+def store_check_cache(rules: str, fingerprints: dict[str, str]):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Hooks may check concurrently, each run replaces the whole file
+    with atomic_write(check_cache_path) as f:
+        json.dump({ 'rules': rules, 'groups': fingerprints }, f)
+
+def load_changed_groups(previous: dict[str, str], jobs: int) -> tuple[list[pkmn_group], dict[str, str], set[int]] :
+    raw_data = load_json('pokemon.json')
+    if not isinstance(raw_data, list) :
+        raise ValueError('pokemon.json does not contain a list of groups')
+    fingerprints: dict[str, str] = {}
+    changed: list[tuple[int, object]] = []
+    for idx, data in enumerate(raw_data) :
+        fingerprint = group_fingerprint(data)
+        number = data.get('number') if isinstance(data, dict) else None
+        key = str(number)
+        if not isinstance(number, int) or key in fingerprints or previous.get(key) != fingerprint :
+            changed.append((idx, data))
+        fingerprints.setdefault(key, fingerprint)
+    # Only the groups that changed since the last clean run need to match the schema again
+    try:
+        validate_groups([x[1] for x in changed], jobs)
+    except group_validation_error as e:
+        raise group_validation_error([(changed[idx][0], number, messages) for idx, number, messages in e.errors])
+    changed_numbers = set(x[1]['number'] for x in changed)
+    removed_numbers = set(int(x) for x in previous if x not in fingerprints)
+    groups = list(pkmn_group(x) for x in raw_data)
+    # Rules between groups depend on the pre-evolution and evolutions of each group
+    affected = set(changed_numbers)
+    for group in groups :
+        if group.number in changed_numbers and group.evolves_from is not None :
+            affected.add(group.evolves_from)
+        if group.evolves_from in changed_numbers or group.evolves_from in removed_numbers :
+            affected.add(group.number)
+    return groups, fingerprints, affected
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Checks the data and the sprites')
+    parser.add_argument('--incremental', action='store_true', help='only check the groups that changed since the last clean run, along with their evolution neighbours')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used for schema validation, 0 to use all cores (default: 1)')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    instrumentation.configure(args)
+
     logger = error_logger()
 
     try:
@@ -147,17 +294,38 @@ def main() -> int :
         print(f"Type data does not match the provided schema: {e}")
         return 1
 
+    rules = rules_digest()
+    previous = load_check_cache(rules) if args.incremental else {}
+    only: set[int] | None = None
+    raw_data: list = []
+    fingerprints: dict[str, str] | None = None
     try:
-        pokemon_data = load_groups()
+        if len(previous) > 0 :
+            groups, fingerprints, only = load_changed_groups(previous, jobs)
+        else:
+            # The parsed document is kept, so that the fingerprints of a clean run do not need to read it again
+            with stage('load_groups'):
+                raw_data = load_validated_json('pokemon.json', jobs=jobs)
+                groups = list(pkmn_group(x) for x in raw_data)
         print('Pokémon schema validation OK')
+    except group_validation_error as e:
+        print('Pokémon data does not match the provided schema')
+        report_validation_errors(e, logger)
+        return 1
     except Exception as e:
         print(f"Pokémon data does not match the provided schema: {e}")
         return 1
 
-    check_pokemon_groups(pokemon_data, logger)
+    check_all(groups, list(type_data.keys()), logger, only)
 
     if logger.ok() :
-        print(f"Checked {len(pokemon_data)} groups => all OK")
+        if fingerprints is None :
+            fingerprints = { str(x['number']): group_fingerprint(x) for x in raw_data }
+        store_check_cache(rules, fingerprints)
+        if only is not None :
+            print(f"Checked {len(only)} changed or related groups out of {len(groups)} => all OK")
+        else:
+            print(f"Checked {len(groups)} groups => all OK")
         return 0
     return 1
 
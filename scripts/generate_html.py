@@ -1,19 +1,39 @@
 
 import os
+import sys
+import json
+import argparse
+import contextlib
+
+from typing import Iterable, Iterator
 
 from lxml import etree
 
-from pokemon_data import load_groups
+import instrumentation
+from instrumentation import stage
+from pokemon_data import atomic_write, iter_groups, load_types, pkmn_group
 
 
 dest_dir = 'generated'
+pages_dest_dir = os.path.join(dest_dir, 'pages')
+
+indent_space = '    '
 
-def dump_html(path: str, document: etree.ElementTree):
-    etree.indent(document, space='    ')
-    with open(path, 'wb') as f:
-        f.write(b'<!doctype html>\n')
-        f.write(etree.tostring(document, pretty_print=True, encoding='utf-8', method='html', xml_declaration=False))
-        # document.write(f, encoding='utf-8', method='html', xml_declaration=False)
+def write_indented(xf, element: etree.Element, level: int):
+    # Each element is indented on its own before being serialized, which gives the same output as indenting the whole document
+    etree.indent(element, space=indent_space, level=level)
+    xf.write('\n' + indent_space * level)
+    xf.write(element)
+
+@contextlib.contextmanager
+def html_document(path: str):
+    with atomic_write(path, 'wb') as f:
+        with etree.htmlfile(f, encoding='utf-8') as xf:
+            xf.write_doctype('<!doctype html>')
+            with xf.element('html', lang='en-GB'):
+                yield xf
+                xf.write('\n')
+        f.write(b'\n')
 
 
 inline_styles = """
@@ -48,18 +68,143 @@ td:nth-last-child(1) {
 }
 """
 
-def generate_document(table: etree.Element) -> etree.ElementTree:
-    html = etree.Element('html', lang='en-GB')
-    head = etree.SubElement(html, 'head')
+pages_styles = """
+nav.pages {
+    margin: 8px 0;
+}
+nav.pages a, nav.pages strong {
+    margin-right: 8px;
+}
+"""
+
+virtual_styles = """
+.pkmn-row {
+    display: grid;
+    grid-template-columns: 4em 120px 120px 1fr 1fr 12em 3em 80px;
+    align-items: center;
+    height: 48px;
+    box-sizing: border-box;
+    border-bottom: 1px solid black;
+}
+.pkmn-row > div {
+    padding-left: 4px;
+    padding-right: 4px;
+    overflow: hidden;
+    white-space: nowrap;
+}
+.pkmn-row.header {
+    font-weight: bold;
+    border-bottom-width: 2px;
+}
+.pkmn-row.group-start {
+    border-top: 2px solid black;
+}
+.pkmn-row > div:nth-child(-n+3),
+.pkmn-row > div:nth-last-child(-n+2) {
+    text-align: center;
+}
+#pkmn-viewport {
+    height: calc(100vh - 160px);
+    overflow-y: auto;
+    contain: strict;
+}
+#pkmn-rows {
+    position: relative;
+}
+"""
+
+# Only the rows intersecting the viewport (plus a small margin) are kept in the DOM
+virtual_script = """
+const rowHeight = 48;
+const overscan = 8;
+const viewport = document.getElementById('pkmn-viewport');
+const container = document.getElementById('pkmn-rows');
+
+function cell(row, content) {
+    const div = document.createElement('div');
+    if (content !== undefined) {
+        div.append(content);
+    }
+    row.append(div);
+    return div;
+}
+
+function link(href, text) {
+    const a = document.createElement('a');
+    a.href = href;
+    a.textContent = text;
+    return a;
+}
+
+function sprites(number, variant, female, shiny) {
+    const span = document.createElement('span');
+    span.className = 'pkmn-icon n' + String(number).padStart(4, '0') + (variant !== null ? ' ' + variant : '') + (female ? ' female' : '') + (shiny ? ' shiny' : '');
+    return span;
+}
+
+function renderRow(index, i) {
+    const [number, groupSize, variant, genderVariant, nameEn, nameFr, bulbapedia, pokepedia, gen, types] = index.rows[i];
+    const row = document.createElement('div');
+    row.className = groupSize > 0 ? 'pkmn-row group-start' : 'pkmn-row';
+    row.style.position = 'absolute';
+    row.style.top = (i * rowHeight) + 'px';
+    row.style.left = row.style.right = '0';
+    cell(row, groupSize > 0 ? String(number).padStart(4, '0') : '');
+    for (const shiny of [false, true]) {
+        const icons = cell(row);
+        icons.append(sprites(number, variant, false, shiny));
+        if (genderVariant) {
+            icons.append(sprites(number, variant, true, shiny));
+        }
+    }
+    cell(row, link(index.link_prefixes[bulbapedia[0]] + bulbapedia[1], nameEn));
+    cell(row, link(index.link_prefixes[pokepedia[0]] + pokepedia[1], nameFr));
+    const variantCell = cell(row);
+    if (variant !== null) {
+        const code = document.createElement('code');
+        code.textContent = variant;
+        variantCell.append(code);
+    }
+    cell(row, String(gen));
+    const typeCell = cell(row);
+    for (const type of types) {
+        const span = document.createElement('span');
+        span.className = 'pkmn-type icon g3 ' + index.types[type];
+        typeCell.append(span);
+    }
+    return row;
+}
+
+fetch('rows.json').then(response => response.json()).then(index => {
+    container.style.height = (index.rows.length * rowHeight) + 'px';
+    let rendered = [-1, -1];
+    function render() {
+        const start = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - overscan);
+        const end = Math.min(index.rows.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / rowHeight) + overscan);
+        if (start === rendered[0] && end === rendered[1]) {
+            return;
+        }
+        rendered = [start, end];
+        const rows = [];
+        for (let i = start; i < end; i++) {
+            rows.push(renderRow(index, i));
+        }
+        container.replaceChildren(...rows);
+    }
+    viewport.addEventListener('scroll', () => requestAnimationFrame(render), { passive: true });
+    window.addEventListener('resize', () => requestAnimationFrame(render));
+    render();
+});
+"""
+
+def generate_head(title: str = 'Simple Pokédex test', root: str = '', styles: str = inline_styles) -> etree.Element :
+    head = etree.Element('head')
     etree.SubElement(head, 'meta', charset='utf-8')
-    etree.SubElement(head, 'title').text = 'Simple Pokédex test'
-    etree.SubElement(head, 'link', rel='stylesheet', href="spritesheets/styles.css")
-    etree.SubElement(head, 'style').text = inline_styles
+    etree.SubElement(head, 'title').text = title
+    etree.SubElement(head, 'link', rel='stylesheet', href=f"{root}spritesheets/styles.css")
+    etree.SubElement(head, 'style').text = styles
     # <script src="script.js"></script>
-    body = etree.SubElement(html, 'body')
-    etree.SubElement(body, 'h1').text = "Simple Pokédex"
-    body.append(table)
-    return etree.ElementTree(html)
+    return head
 
 def insert_sprites(common_parent: etree.Element, shiny_parent: etree.Element, group_num: int, variant: str | None, female: bool):
     classes: list[str] = ['pkmn-icon', f"n{group_num:04d}"]
@@ -72,13 +217,8 @@ def insert_sprites(common_parent: etree.Element, shiny_parent: etree.Element, gr
     shiny_parent.append(etree.Element('span', attrib={'class': f"{classes_str} shiny"}))
 
 
-def main():
-    os.makedirs(dest_dir, exist_ok=True)
-
-    pokemon_data = load_groups()
-
-    table = etree.Element('table', attrib={'id': 'pkmn-table'})
-    header = etree.SubElement(table, 'tr')
+def generate_header() -> etree.Element :
+    header = etree.Element('tr')
     etree.SubElement(header, 'th').text = "N°"
     etree.SubElement(header, 'th').text = "Common"
     etree.SubElement(header, 'th').text = "Shiny"
@@ -87,31 +227,191 @@ def main():
     etree.SubElement(header, 'th').text = "Variant"
     etree.SubElement(header, 'th').text = "Gen"
     etree.SubElement(header, 'th').text = "Type"
+    return header
+
+def generate_rows(group: pkmn_group) -> Iterator[etree.Element] :
+    first = True
+    for form in group.forms:
+        line = etree.Element('tr')
+        if first:
+            line.attrib['class'] = 'group-start'
+            etree.SubElement(line, 'td', rowspan=str(len(group.forms))).text = f"{group.number:04d}"
+        icon_cell = etree.SubElement(line, 'td')
+        shiny_cell = etree.SubElement(line, 'td')
+        insert_sprites(icon_cell, shiny_cell, group.number, form.variant, False)
+        if form.gender_variant: 
+            insert_sprites(icon_cell, shiny_cell, group.number, form.variant, True)
+        etree.SubElement(etree.SubElement(line, 'td'), 'a', href=form.links.bulbapedia).text = form.names.en
+        etree.SubElement(etree.SubElement(line, 'td'), 'a', href=form.links.pokepedia).text = form.names.fr
+        variant_cell = etree.SubElement(line, 'td')
+        if form.variant is not None :
+            etree.SubElement(variant_cell, 'code').text = form.variant
+        etree.SubElement(line, 'td').text = str(form.gen)
+        type_cell = etree.SubElement(line, 'td')
+        for type in form.types :
+            etree.SubElement(type_cell, 'span', attrib={'class': f"pkmn-type icon g3 {type}"})
+        first = False
+        yield line
+
+
+def write_table(xf, pokemon_data: Iterable[pkmn_group], level: int):
+    xf.write('\n' + indent_space * level)
+    with xf.element('table', attrib={'id': 'pkmn-table'}):
+        write_indented(xf, generate_header(), level + 1)
+        for group in pokemon_data:
+            for line in generate_rows(group):
+                write_indented(xf, line, level + 1)
+        xf.write('\n' + indent_space * level)
+
+def generate_navigation(page_names: list[str], current: int) -> etree.Element :
+    nav = etree.Element('nav', attrib={'class': 'pages'})
+    if current > 0 :
+        etree.SubElement(nav, 'a', href=f"{page_names[current - 1]}.html", rel='prev').text = "Previous"
+    for idx, name in enumerate(page_names) :
+        if idx == current :
+            etree.SubElement(nav, 'strong').text = name
+        else:
+            etree.SubElement(nav, 'a', href=f"{name}.html").text = name
+    if current < len(page_names) - 1 :
+        etree.SubElement(nav, 'a', href=f"{page_names[current + 1]}.html", rel='next').text = "Next"
+    etree.SubElement(nav, 'a', href='../index.html').text = "All"
+    return nav
 
+def generate_pages(pages: dict[str, list[pkmn_group]]):
+    os.makedirs(pages_dest_dir, exist_ok=True)
+    # Remove the pages left by a previous run with a different partitioning
+    for entry in os.scandir(pages_dest_dir) :
+        if entry.is_file() and entry.name.endswith('.html') and entry.name[:-len('.html')] not in pages :
+            os.remove(entry.path)
+    page_names = list(pages.keys())
+    for idx, (name, groups) in enumerate(pages.items()) :
+        page_dest = os.path.join(pages_dest_dir, f"{name}.html")
+        with html_document(page_dest) as xf:
+            write_indented(xf, generate_head(f"Simple Pokédex test ({name})", '../', inline_styles + pages_styles), 1)
+            xf.write('\n' + indent_space)
+            with xf.element('body'):
+                title = etree.Element('h1')
+                title.text = f"Simple Pokédex ({name})"
+                write_indented(xf, title, 2)
+                write_indented(xf, generate_navigation(page_names, idx), 2)
+                write_table(xf, groups, 2)
+                write_indented(xf, generate_navigation(page_names, idx), 2)
+                xf.write('\n' + indent_space)
+        print(f"Page saved at {page_dest}")
+
+
+def split_link(url: str, prefixes: dict[str, int]) -> list :
+    cut = url.rfind('/') + 1
+    return [prefixes.setdefault(url[:cut], len(prefixes)), url[cut:]]
+
+def generate_rows_index(pokemon_data: Iterable[pkmn_group], pkmn_types: list[str]) -> dict :
+    # One array per form, the link prefixes and types are stored once and referenced by index
+    prefixes: dict[str, int] = {}
+    type_ids = { x: i for i, x in enumerate(pkmn_types) }
+    rows: list[list] = []
     for group in pokemon_data:
         first = True
         for form in group.forms:
-            line = etree.SubElement(table, 'tr')
-            if first:
-                line.attrib['class'] = 'group-start'
-                etree.SubElement(line, 'td', rowspan=str(len(group.forms))).text = f"{group.number:04d}"
-            icon_cell = etree.SubElement(line, 'td')
-            shiny_cell = etree.SubElement(line, 'td')
-            insert_sprites(icon_cell, shiny_cell, group.number, form.variant, False)
-            if form.gender_variant: 
-                insert_sprites(icon_cell, shiny_cell, group.number, form.variant, True)
-            etree.SubElement(etree.SubElement(line, 'td'), 'a', href=form.links.bulbapedia).text = form.names.en
-            etree.SubElement(etree.SubElement(line, 'td'), 'a', href=form.links.pokepedia).text = form.names.fr
-            variant_cell = etree.SubElement(line, 'td')
-            if form.variant is not None :
-                etree.SubElement(variant_cell, 'code').text = form.variant
-            etree.SubElement(line, 'td').text = str(form.gen)
-            type_cell = etree.SubElement(line, 'td')
-            for type in form.types :
-                etree.SubElement(type_cell, 'span', attrib={'class': f"pkmn-type icon g3 {type}"})
+            rows.append([
+                group.number,
+                len(group.forms) if first else 0,
+                form.variant,
+                1 if form.gender_variant else 0,
+                form.names.en,
+                form.names.fr,
+                split_link(form.links.bulbapedia, prefixes),
+                split_link(form.links.pokepedia, prefixes),
+                form.gen,
+                [type_ids[x] for x in form.types]
+            ])
             first = False
+    return {
+        'columns': ['number', 'group_size', 'variant', 'gender_variant', 'name_en', 'name_fr', 'bulbapedia', 'pokepedia', 'gen', 'types'],
+        'link_prefixes': list(prefixes.keys()),
+        'types': pkmn_types,
+        'rows': rows
+    }
+
+def generate_virtual(pokemon_data: Iterable[pkmn_group], pkmn_types: list[str]):
+    rows_dest = os.path.join(dest_dir, 'rows.json')
+    with atomic_write(rows_dest) as f:
+        json.dump(generate_rows_index(pokemon_data, pkmn_types), f, ensure_ascii=False, separators=(',', ':'))
+    print(f"Row index saved at {rows_dest}")
+    virtual_dest = os.path.join(dest_dir, 'virtual.html')
+    with html_document(virtual_dest) as xf:
+        write_indented(xf, generate_head('Simple Pokédex test', '', inline_styles + virtual_styles), 1)
+        xf.write('\n' + indent_space)
+        with xf.element('body'):
+            title = etree.Element('h1')
+            title.text = "Simple Pokédex"
+            write_indented(xf, title, 2)
+            header = etree.Element('div', attrib={'class': 'pkmn-row header'})
+            for column in ["N°", "Common", "Shiny", "Name (EN)", "Name (FR)", "Variant", "Gen", "Type"] :
+                etree.SubElement(header, 'div').text = column
+            write_indented(xf, header, 2)
+            viewport = etree.Element('div', attrib={'id': 'pkmn-viewport'})
+            etree.SubElement(viewport, 'div', attrib={'id': 'pkmn-rows'})
+            write_indented(xf, viewport, 2)
+            script = etree.Element('script')
+            script.text = virtual_script
+            write_indented(xf, script, 2)
+            xf.write('\n' + indent_space)
+    print(f"Virtual list saved at {virtual_dest}")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace :
+    parser = argparse.ArgumentParser(description='Generates an HTML table of all Pokémon forms')
+    pages_group = parser.add_mutually_exclusive_group()
+    pages_group.add_argument('--paginate-by-gen', action='store_true', help=f"also split the table in one page per generation in {pages_dest_dir}")
+    pages_group.add_argument('--page-size', type=int, metavar='N', help=f"also split the table in pages of N Pokédex numbers in {pages_dest_dir}")
+    parser.add_argument('--virtual', action='store_true', help=f"also emit a JSON row index and a virtual-scrolling list in {dest_dir}")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.page_size is not None and args.page_size <= 0 :
+        parser.error('--page-size must be positive')
+    return args
+
+def generate(pokemon_data: Iterable[pkmn_group], pkmn_types: list[str], args: argparse.Namespace):
+    os.makedirs(dest_dir, exist_ok=True)
+
+    if args.paginate_by_gen or args.page_size is not None or args.virtual :
+        # Every output needs its own pass over the groups
+        pokemon_data = list(pokemon_data)
+
+    # Rows are serialized as soon as their group is read, so the whole table never lives in memory
+    with stage('index'), html_document(os.path.join(dest_dir, 'index.html')) as xf:
+        write_indented(xf, generate_head(), 1)
+        xf.write('\n' + indent_space)
+        with xf.element('body'):
+            title = etree.Element('h1')
+            title.text = "Simple Pokédex"
+            write_indented(xf, title, 2)
+            write_table(xf, pokemon_data, 2)
+            xf.write('\n' + indent_space)
+
+    if args.paginate_by_gen or args.page_size is not None :
+        pages: dict[str, list[pkmn_group]] = {}
+        for group in pokemon_data:
+            if args.paginate_by_gen :
+                # A group is listed with the generation of its first form, its other forms stay on the same page
+                name = f"gen{group.forms[0].gen}"
+            else:
+                start = ((group.number - 1) // args.page_size) * args.page_size + 1
+                name = f"n{start:04d}-{start + args.page_size - 1:04d}"
+            pages.setdefault(name, []).append(group)
+        with stage('pages'):
+            generate_pages(pages)
+
+    if args.virtual :
+        with stage('virtual'):
+            generate_virtual(pokemon_data, pkmn_types)
 
-    dump_html(os.path.join(dest_dir, 'index.html'), generate_document(table))
+def main(argv: list[str] | None = None) -> int :
+    args = parse_args(argv)
+    instrumentation.configure(args)
+    with stage('html'):
+        generate(iter_groups(), list(load_types().keys()), args)
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
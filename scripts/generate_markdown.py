@@ -1,9 +1,15 @@
 
 import os
+import sys
+import argparse
 
 from enum import Enum
+from typing import Iterable
 
-from pokemon_data import load_groups, load_types, pkmn_form
+import instrumentation
+from instrumentation import stage
+from pokemon_data import atomic_write, iter_groups, load_types, pkmn_form, pkmn_group
+from pokemon_sprites import sprite_path
 
 
 dest_dir = 'generated'
@@ -14,8 +20,9 @@ class alignment(Enum):
     RIGHT = 1
     CENTER = 2
 
-def write_lines(lines: list[str], filepath: str):
-    with open(filepath, 'w') as f:
+def write_lines(lines, filepath: str):
+    # Lines may come from a stream of groups, the file is only replaced once all of them were written
+    with atomic_write(filepath) as f:
         for line in lines:
             f.write(line)
             f.write('\n')
@@ -35,15 +42,11 @@ def sprite_for_form(form: pkmn_form, group_num: int, shiny: bool, spritesheet: b
         if form.gender_variant:
             res += f"![{form.names.en} female sprite][{sprites}]{{{classes} .female}}"
         return res
-    shiny_name = 'shiny' if shiny else 'common'
-    base_path = f"../sprites/{shiny_name}/icons/{group_num:04d}"
-    if form.variant is not None :
-        suffix = f"_{form.variant}.png"
-    else:
-        suffix = '.png'
     if not form.gender_variant:
-        return f"![{form.names.en} sprite]({base_path}{suffix})"
-    return f"![{form.names.en} male sprite]({base_path}_m{suffix}) ![{form.names.en} female sprite]({base_path}_f{suffix})"
+        return f"![{form.names.en} sprite](../{sprite_path(group_num, form.variant, shiny)})"
+    male_path = sprite_path(group_num, form.variant, shiny, True, False)
+    female_path = sprite_path(group_num, form.variant, shiny, True, True)
+    return f"![{form.names.en} male sprite](../{male_path}) ![{form.names.en} female sprite](../{female_path})"
 
 def sprite_for_type(type: str, spritesheet: bool) -> str :
     if spritesheet:
@@ -52,14 +55,12 @@ def sprite_for_type(type: str, spritesheet: bool) -> str :
 
 
 
-def main():
+def generate(pokemon_data: Iterable[pkmn_group], type_ids: list[str]):
     os.makedirs(dest_dir, exist_ok=True)
 
     insert_images=False
     use_spritesheets=False # With extended Markdown syntax to apply classes on elements
 
-    pokemon_data = load_groups()
-
     header: list[tuple[str, alignment]] = [('N°', alignment.CENTER)]
     if insert_images :
         header.extend([
@@ -73,45 +74,53 @@ def main():
         ('Gen', alignment.CENTER)
     ])
 
-    lines = ["| " + " | ".join(h[0] for h in header) + " |"]
-    separator = "|"
-    for h in header:
-        separator += ("-" if h[1] == alignment.RIGHT else ":")
-        separator += "-" * len(h[0])
-        separator += ("-" if h[1] == alignment.LEFT else ":")
-        separator += "|"
-    lines.append(separator)
-
-
-    for group in pokemon_data:
-        for form in group.forms:
-            line = [f"{group.number:04d}"]
-            if insert_images:
-                line.append(sprite_for_form(form, group.number, False, use_spritesheets))
-                line.append(sprite_for_form(form, group.number, True, use_spritesheets))
-            line.append(f"[{form.names.en}]({form.links.bulbapedia})")
-            line.append(f"[{form.names.fr}]({form.links.pokepedia})")
-            if insert_images:
-                line.append(" ".join(sprite_for_type(x, use_spritesheets) for x in form.types))
+    def generate_lines():
+        yield "| " + " | ".join(h[0] for h in header) + " |"
+        separator = "|"
+        for h in header:
+            separator += ("-" if h[1] == alignment.RIGHT else ":")
+            separator += "-" * len(h[0])
+            separator += ("-" if h[1] == alignment.LEFT else ":")
+            separator += "|"
+        yield separator
+
+        # Groups may be streamed, in which case lines are written as soon as their group is parsed
+        for group in pokemon_data:
+            for form in group.forms:
+                line = [f"{group.number:04d}"]
+                if insert_images:
+                    line.append(sprite_for_form(form, group.number, False, use_spritesheets))
+                    line.append(sprite_for_form(form, group.number, True, use_spritesheets))
+                line.append(f"[{form.names.en}]({form.links.bulbapedia})")
+                line.append(f"[{form.names.fr}]({form.links.pokepedia})")
+                if insert_images:
+                    line.append(" ".join(sprite_for_type(x, use_spritesheets) for x in form.types))
+                else:
+                    line.append(", ".join(form.types))
+                line.append(str(form.gen))
+                yield "| " + " | ".join(line) + " |"
+
+        # We use reference-style links for images to reduce the document size
+        if insert_images:
+            yield ''
+            if use_spritesheets:
+                yield f"[{common_spritesheet}]: ./spritesheets/common.png"
+                yield f"[{shiny_spritesheet}]: ./spritesheets/shiny.png"
+                yield f"[{types_spritesheet}]: ./spritesheets/type_icons_g3.png"
             else:
-                line.append(", ".join(form.types))
-            line.append(str(form.gen))
-            lines.append("| " + " | ".join(line) + " |")
-
-    # We use reference-style links for images to reduce the document size
-    if insert_images:
-        lines.append('')
-        if use_spritesheets:
-            lines.extend([
-                f"[{common_spritesheet}]: ./spritesheets/common.png",
-                f"[{shiny_spritesheet}]: ./spritesheets/shiny.png",
-                f"[{types_spritesheet}]: ./spritesheets/type_icons_g3.png"
-            ])
-        else:
-            for type in load_types().keys():
-                lines.append(f"[{type} type]: ../sprites/types/{type}/en/icon_g3.png")
-
-    write_lines(lines, os.path.join(dest_dir, 'pokemon.md'))
+                for type in type_ids:
+                    yield f"[{type} type]: ../sprites/types/{type}/en/icon_g3.png"
+
+    write_lines(generate_lines(), os.path.join(dest_dir, 'pokemon.md'))
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Generates a Markdown table of all Pokémon forms')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure(args)
+    with stage('markdown'):
+        generate(iter_groups(), list(load_types().keys()))
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
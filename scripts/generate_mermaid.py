@@ -1,11 +1,22 @@
 
 import os
 import sys
+import json
+import math
+import argparse
+import contextlib
 
-from pokemon_data import load_groups
+from concurrent.futures import ProcessPoolExecutor
+
+from typing import Iterator
+
+import instrumentation
+from instrumentation import open_file, stage
+from pokemon_data import load_evolutions, pkmn_evolutions
 
 
 dest_dir = './generated/diagrams'
+families_dest_dir = os.path.join(dest_dir, 'families')
 
 
 class state_sub_node:
@@ -35,42 +46,78 @@ class state_diagram:
     def __init__(self):
         self.nodes: dict[int, state_node] = {}
         self.inter_connections: list[tuple[str, str]] = []
-    
-    def get_lines(self) -> list[str] :
-        res: list[str] = [
-            'stateDiagram-v2',
-            '    direction TB',
-            '    classDef temporary font-style:italic',
-            ''
-        ]
+        # Connections are attached to the group they lead to, so that the diagram can be split by family
+        self._group_connections: dict[int, list[tuple[str, str]]] = {}
+
+    def connect(self, number: int, from_id: str, to_id: str):
+        self.inter_connections.append((from_id, to_id))
+        self._group_connections.setdefault(number, []).append((from_id, to_id))
+
+    def sub_diagram(self, numbers: list[int]) -> 'state_diagram' :
+        # Groups are connected in order, so listing the connections group by group keeps their order in the full diagram
+        res = state_diagram()
+        for number in numbers :
+            res.nodes[number] = self.nodes[number]
+        for number in numbers :
+            for conn in self._group_connections.get(number, []) :
+                res.connect(number, conn[0], conn[1])
+        return res
+
+    def get_lines(self) -> Iterator[str] :
+        yield 'stateDiagram-v2'
+        yield '    direction TB'
+        yield '    classDef temporary font-style:italic'
+        yield ''
 
         for node in self.nodes.values() :
             graph_id = node.graph_id()
-            res.append(f"    state \"{node.name}\" as {graph_id}")
             if len(node.sub_nodes) > 0 :
-                res[-1] += " {"
+                yield f"    state \"{node.name}\" as {graph_id} {{"
                 for sub_node in node.sub_nodes.values() :
-                    res.append(f"        state \"{sub_node.name}\" as {sub_node.graph_id}")
+                    yield f"        state \"{sub_node.name}\" as {sub_node.graph_id}"
                     if sub_node.temporary :
-                        res.append(f"        class {sub_node.graph_id} temporary")
+                        yield f"        class {sub_node.graph_id} temporary"
                 for conn in node.intra_connections :
-                    res.append(f"        {conn[0]} --> {conn[1]}")
-                res.append("    }")
-            res.append('')
+                    yield f"        {conn[0]} --> {conn[1]}"
+                yield "    }"
+            else:
+                yield f"    state \"{node.name}\" as {graph_id}"
+            yield ''
 
         for conn in self.inter_connections :
-            res.append(f"    {conn[0]} --> {conn[1]}")
+            yield f"    {conn[0]} --> {conn[1]}"
 
-        return res
 
+def write_diagram(path: str, diagram: state_diagram) -> bool :
+    content = "\n".join(diagram.get_lines())
+    if os.path.isfile(path) :
+        with open_file(path, 'r') as f:
+            if f.read() == content :
+                return False
+    with open_file(path, 'w') as f:
+        f.write(content)
+    return True
 
+def write_family_diagrams(diagram: state_diagram, families: list[tuple[str, list[int]]]) -> int :
+    return sum(1 for path, numbers in families if write_diagram(path, diagram.sub_diagram(numbers)))
 
-def main() -> int :
-    pokemon_data = load_groups()
-    
+# Full diagram of a worker process, sent once when the worker starts rather than with every family
+_worker_diagram: state_diagram | None = None
+
+def init_family_worker(diagram: state_diagram):
+    global _worker_diagram
+    _worker_diagram = diagram
+
+def write_family_chunk(families: list[tuple[str, list[int]]]) -> int :
+    return write_family_diagrams(_worker_diagram, families)
+
+
+
+def generate(evolutions: pkmn_evolutions, per_family: bool = False, jobs: int = 1) -> int :
+    index = evolutions.index
     diagram = state_diagram()
 
-    for group in pokemon_data :
+    for group in index.groups :
         group_name = group.common_names.en if group.common_names is not None else group.forms[0].names.en
         node = state_node(group.number, group_name)
         diagram.nodes[node.number] = node
@@ -78,39 +125,80 @@ def main() -> int :
             for form in group.forms :
                 node.add_sub_node(form.variant, form.names.en, form.is_temporary())
         
-    for group in pokemon_data :
+    for group in index.groups :
         node = diagram.nodes[group.number]
         if group.evolves_from is not None :
-            pre_node = diagram.nodes[group.evolves_from]
+            if group.number in evolutions.unknown :
+                print(f"Group {group.number} evolves from unknown group {group.evolves_from}")
+                return 1
+            pre_node = diagram.nodes[evolutions.parent(group.number)]
             for form in group.forms :
                 if len(node.sub_nodes) == 0 :
                     form_graph_id = node.graph_id()
                 else:
                     form_graph_id = node.sub_nodes[form.variant].graph_id
-                if form.evolution_variants is not None :
-                    for evolution_variants in form.evolution_variants :
-                        pre_graph_id = pre_node.sub_nodes[evolution_variants].graph_id
-                        diagram.inter_connections.append((pre_graph_id, form_graph_id))
-                elif form.variant is not None and form.variant in pre_node.sub_nodes :
-                    pre_graph_id = pre_node.sub_nodes[form.variant].graph_id
-                    diagram.inter_connections.append((pre_graph_id, form_graph_id))
-                elif len(pre_node.sub_nodes) > 0 :
-                    pre_graph_id = pre_node.sub_nodes[None].graph_id
-                    diagram.inter_connections.append((pre_graph_id, form_graph_id))
-                else:
-                    diagram.inter_connections.append((pre_node.graph_id(), form_graph_id))
+                for pre_variant in evolutions.pre_evolution_variants(group, form) :
+                    if len(pre_node.sub_nodes) == 0 :
+                        pre_graph_id = pre_node.graph_id()
+                    else:
+                        pre_graph_id = pre_node.sub_nodes[pre_variant].graph_id
+                    diagram.connect(group.number, pre_graph_id, form_graph_id)
                 if form.derives is not None :
                     for derivation_variant in form.derives.from_variants :
                         deriv_graph_id = node.sub_nodes[derivation_variant].graph_id
                         node.intra_connections.append((deriv_graph_id, form_graph_id))
 
     os.makedirs(dest_dir, exist_ok=True)
-    
-    with open(os.path.join(dest_dir, 'full.mermaid'), 'w') as f:
-        f.write("\n".join(diagram.get_lines()))
-
-        
-
+    with stage('write'):
+        write_diagram(os.path.join(dest_dir, 'full.mermaid'), diagram)
+
+    if per_family :
+        with stage('families'):
+            generate_families(diagram, evolutions, jobs)
+    return 0
+
+def generate_families(diagram: state_diagram, evolutions: pkmn_evolutions, jobs: int):
+    families: dict[int, list[int]] = {}
+    for number in diagram.nodes :
+        families.setdefault(evolutions.root(number), []).append(number)
+
+    os.makedirs(families_dest_dir, exist_ok=True)
+    names = { root: f"{root:04d}.mermaid" for root in families }
+    # Remove the diagrams of families that do not exist anymore
+    for entry in os.scandir(families_dest_dir) :
+        if entry.is_file() and entry.name.endswith('.mermaid') and entry.name not in names.values() :
+            os.remove(entry.path)
+    family_paths = [(os.path.join(families_dest_dir, names[root]), numbers) for root, numbers in families.items()]
+
+    with ProcessPoolExecutor(jobs, initializer=init_family_worker, initargs=(diagram,)) if jobs > 1 else contextlib.nullcontext() as pool:
+        if pool is not None :
+            chunk_size = math.ceil(len(family_paths) / jobs)
+            written = sum(pool.map(write_family_chunk, [family_paths[i:i+chunk_size] for i in range(0, len(family_paths), chunk_size)]))
+        else:
+            written = write_family_diagrams(diagram, family_paths)
+
+    index = {
+        'groups': { str(number): f"families/{names[root]}" for root, numbers in families.items() for number in numbers },
+        'families': { f"families/{names[root]}": numbers for root, numbers in families.items() }
+    }
+    index_dest = os.path.join(dest_dir, 'families.json')
+    with open_file(index_dest, 'w') as f:
+        json.dump(index, f, indent=4)
+    print(f"Wrote {written} out of {len(family_paths)} family diagrams in {families_dest_dir}, indexed in {index_dest}")
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace :
+    parser = argparse.ArgumentParser(description='Generates Mermaid state diagrams of the evolutions of all Pokémon forms')
+    parser.add_argument('--per-family', action='store_true', help=f"also write one small diagram per evolution family in {families_dest_dir}, along with an index")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used to write the family diagrams, 0 to use all cores (default: 1)')
+    instrumentation.add_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> int :
+    args = parse_args(argv)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    instrumentation.configure(args)
+    with stage('mermaid'):
+        return generate(load_evolutions(), args.per_family, jobs)
 
 
 if __name__ == '__main__':
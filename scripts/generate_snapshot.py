@@ -0,0 +1,164 @@
+import os
+import sys
+import struct
+import hashlib
+import argparse
+
+from typing import Iterable
+
+import instrumentation
+from instrumentation import open_file, stage
+from pokemon_data import atomic_write, load_groups, load_types, pkmn_group, pkmn_names, pkmn_type, snapshot_path, snapshot_magic, snapshot_version, snapshot_none, snapshot_header, snapshot_range, snapshot_group_record, snapshot_form_record, snapshot_type_record, snapshot_gender_ratios, snapshot_format_error, pkmn_snapshot
+
+
+class snapshot_builder:
+    def __init__(self):
+        self._strings: dict[str, int] = {}
+        self._string_data = bytearray()
+        self._string_offsets: list[int] = [0]
+        self._lists: dict[tuple[int, ...], int] = {}
+        self._list_items: list[int] = []
+        self._list_offsets: list[int] = [0]
+
+    def string(self, value: str | None) -> int :
+        if value is None :
+            return snapshot_none
+        res = self._strings.get(value)
+        if res is None :
+            res = len(self._strings)
+            self._strings[value] = res
+            self._string_data += value.encode()
+            self._string_offsets.append(len(self._string_data))
+        return res
+
+    def string_list(self, values: Iterable[str | None] | None) -> int :
+        if values is None :
+            return snapshot_none
+        key = tuple(self.string(x) for x in values)
+        res = self._lists.get(key)
+        if res is None :
+            res = len(self._lists)
+            self._lists[key] = res
+            self._list_items.extend(key)
+            self._list_offsets.append(len(self._list_items))
+        return res
+
+    def names(self, names: pkmn_names | None) -> tuple[int, int] :
+        if names is None :
+            return snapshot_none, snapshot_none
+        return self.string(names.fr), self.string(names.en)
+
+    def link(self, url: str) -> tuple[int, int] :
+        # Same split as the in-memory model, so the shared prefixes are only stored once
+        cut = url.rfind('/') + 1
+        return self.string(url[:cut]), self.string(url[cut:])
+
+    def build(self, pokemon_data: list[pkmn_group], pkmn_types: dict[str, pkmn_type], digest: bytes) -> bytes :
+        groups = bytearray()
+        forms = bytearray()
+        form_count = 0
+        index: dict[int, int] = {}
+        for position, group in enumerate(pokemon_data) :
+            # In case of duplicates, the first group is the one found by number, as in pkmn_index
+            index.setdefault(group.number, position)
+            groups += snapshot_group_record.pack(group.number, group.evolves_from or 0, *self.names(group.common_names), form_count, len(group.forms))
+            for form in group.forms :
+                derivation = 0
+                if form.derives is not None :
+                    derivation = 2 if form.derives.battle_only else 1
+                forms += snapshot_form_record.pack(
+                    *self.names(form.names),
+                    *self.link(form.links.bulbapedia),
+                    *self.link(form.links.pokepedia),
+                    self.string_list(form.types),
+                    self.string(form.variant),
+                    self.string_list(form.evolution_variants),
+                    self.string_list(form.derives.from_variants if form.derives is not None else None),
+                    form.gen,
+                    1 if form.gender_variant else 0,
+                    snapshot_gender_ratios.index(form.gender_ratio) + 1 if form.gender_ratio is not None else 0,
+                    derivation
+                )
+                form_count += 1
+        types = bytearray()
+        for type_id, typ in pkmn_types.items() :
+            types += snapshot_type_record.pack(
+                self.string(type_id),
+                *self.names(typ.names),
+                self.string(typ.colour),
+                self.string_list(typ.strong_against),
+                self.string_list(typ.weak_against),
+                self.string_list(typ.ineffective_against)
+            )
+        group_index = b''.join(snapshot_range.pack(number, position) for number, position in sorted(index.items()))
+
+        # Sections are laid out after the header in this order, the variable-length string data comes last
+        sections = [
+            struct.pack(f"<{len(self._string_offsets)}I", *self._string_offsets),
+            struct.pack(f"<{len(self._list_offsets)}I", *self._list_offsets),
+            struct.pack(f"<{len(self._list_items)}I", *self._list_items),
+            bytes(groups),
+            group_index,
+            bytes(forms),
+            bytes(types),
+            bytes(self._string_data)
+        ]
+        positions = []
+        pos = snapshot_header.size
+        for data in sections :
+            positions.append(pos)
+            pos += len(data)
+        fields = [
+            len(self._strings), positions[0], len(self._string_data), positions[7],
+            len(self._lists), positions[1], len(self._list_items), positions[2],
+            len(pokemon_data), positions[3], len(index), positions[4],
+            form_count, positions[5], len(pkmn_types), positions[6]
+        ]
+        header = snapshot_header.pack(snapshot_magic, snapshot_version, digest, *fields)
+        return header + b''.join(sections)
+
+
+def source_digest(filenames: list[str]) -> bytes :
+    hasher = hashlib.sha256(str(snapshot_version).encode())
+    for filename in filenames :
+        with open_file(filename, 'rb') as f:
+            hasher.update(hashlib.sha256(f.read()).digest())
+    return hasher.digest()
+
+def stored_digest(path: str) -> str | None :
+    if not os.path.isfile(path) :
+        return None
+    try:
+        with pkmn_snapshot(path) as snapshot:
+            return snapshot.digest
+    except (OSError, snapshot_format_error):
+        return None
+
+
+def generate(pokemon_data: list[pkmn_group], pkmn_types: dict[str, pkmn_type], force: bool = False, path: str = snapshot_path) -> int :
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = source_digest(['pokemon.json', 'types.json'])
+    if not force and stored_digest(path) == digest.hex() :
+        print(f"Snapshot at {path} is up to date")
+        return 0
+
+    with stage('build'):
+        data = snapshot_builder().build(pokemon_data, pkmn_types, digest)
+    # Readers keep their mapping of the previous file, the new one is swapped in rather than overwritten
+    with stage('write'):
+        with atomic_write(path, 'wb') as f:
+            f.write(data)
+    print(f"Snapshot with {len(pokemon_data)} groups saved at {path} ({len(data)} bytes)")
+    return 0
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Exports the data to a flat binary snapshot that can be memory-mapped by pokemon_data.load_snapshot')
+    parser.add_argument('--force', action='store_true', help='rebuild the snapshot even if the data did not change')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure(args)
+    with stage('snapshot'):
+        return generate(load_groups(), load_types(), args.force)
+
+if __name__ == '__main__':
+    sys.exit(main())
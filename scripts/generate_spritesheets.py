@@ -1,12 +1,25 @@
 
+import io
 import os
+import sys
+import json
 import math
+import shutil
+import time
+import hashlib
+import argparse
+import contextlib
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 from PIL import Image
 
-from pokemon_data import load_groups, load_types
+import instrumentation
+from instrumentation import count_file, open_file, stage
+from pokemon_data import load_groups, load_types, pkmn_group
 
 dest_dir = './generated/spritesheets'
+shards_dest_dir = os.path.join(dest_dir, 'shards')
 
 sprites_base_dir = 'sprites'
 unknown_sprite_path = os.path.join(sprites_base_dir, 'unknown.png')
@@ -19,7 +32,131 @@ icon_sprite_size = (68, 56) # width, height
 type_sprite_class = '.pkmn-type'
 
 languages = ['en', 'fr']
-pkmn_types = load_types()
+
+
+def file_hash(path: str) -> str :
+    with open_file(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def decode_sprite(sprite_path: str, sprite_size: tuple[int, int]) -> bytes :
+    # Runs in worker processes, the decoded pixels are sent back as raw RGBA data
+    count_file('rb')
+    with Image.open(sprite_path) as sprite:
+        if sprite.size != sprite_size :
+            raise RuntimeError(f"Sprite at {sprite_path} has dimensions {sprite.size}, expected {sprite_size}")
+        return sprite.convert('RGBA').tobytes()
+
+def pixel_hash(sprite_path: str) -> str :
+    count_file('rb')
+    with Image.open(sprite_path) as sprite:
+        digest = hashlib.sha256(f"{sprite.size[0]}x{sprite.size[1]}:".encode())
+        digest.update(sprite.convert('RGBA').tobytes())
+        return digest.hexdigest()
+
+class sprite_manifest:
+    def __init__(self, path: str, force: bool = False):
+        self._path = path
+        self._sheets: dict[str, dict] = {}
+        # Hash of the decoded pixels for each known file hash, to avoid decoding unchanged sprites
+        self._pixels: dict[str, str] = {}
+        # Format of the last run, which selects the sheets used by the styles (and by pokemon_sprites)
+        self._format: str | None = None
+        self._dirty = False
+        if not force and os.path.isfile(path) :
+            with open_file(path, 'r') as f:
+                data = json.load(f)
+            self._sheets = data['sheets']
+            self._pixels = data.get('pixels', {})
+            self._format = data.get('format')
+
+    def get(self, sheet_name: str) -> dict | None :
+        return self._sheets.get(sheet_name)
+
+    def set(self, sheet_name: str, sheet: dict):
+        self._sheets[sheet_name] = sheet
+        self._dirty = True
+
+    def remove(self, sheet_name: str):
+        if self._sheets.pop(sheet_name, None) is not None :
+            self._dirty = True
+
+    def sheet_names(self) -> list[str] :
+        return list(self._sheets.keys())
+
+    def pixel_hashes(self, paths: list[str], pool: Executor | None) -> dict[str, tuple[str, str]] :
+        mapper = (lambda f, x: pool.map(f, x, chunksize=64)) if pool is not None else map
+        file_hashes = dict(zip(paths, mapper(file_hash, paths)))
+        missing = [path for path, digest in file_hashes.items() if digest not in self._pixels]
+        for path, digest in zip(missing, mapper(pixel_hash, missing)) :
+            self._pixels[file_hashes[path]] = digest
+            self._dirty = True
+        return { path: (digest, self._pixels[digest]) for path, digest in file_hashes.items() }
+
+    def write(self, image_format: str):
+        if not self._dirty and self._format == image_format :
+            return
+        self._format = image_format
+        with open_file(self._path, 'w') as f:
+            json.dump({ 'format': image_format, 'sheets': self._sheets, 'pixels': self._pixels }, f, indent=4)
+        print(f"Sprite manifest saved at {self._path}")
+
+
+image_extensions = {
+    'png': 'png',
+    'png-max': 'png',
+    'png-palette': 'png',
+    'webp': 'webp'
+}
+
+def to_palette(im: Image.Image) -> Image.Image | None :
+    # Exact mapping of the colours to a palette, only possible if there are at most 256 of them
+    colours = im.getcolors(256)
+    if colours is None :
+        return None
+    index = { bytes(colour): idx for idx, (_, colour) in enumerate(colours) }
+    raw = im.tobytes()
+    res = Image.frombytes('P', im.size, bytes(index[raw[i:i+4]] for i in range(0, len(raw), 4)))
+    res.putpalette([x for _, colour in colours for x in colour], rawmode='RGBA')
+    return res
+
+def encode_png(im: Image.Image, max_compression: bool) -> bytes :
+    if not max_compression :
+        buffer = io.BytesIO()
+        im.save(buffer, 'PNG')
+        return buffer.getvalue()
+    # The optimizer does not always beat the default settings, so both are attempted
+    candidates: list[bytes] = []
+    for optimize in [False, True] :
+        buffer = io.BytesIO()
+        im.save(buffer, 'PNG', optimize=optimize)
+        candidates.append(buffer.getvalue())
+    return min(candidates, key=len)
+
+def encode_image(im: Image.Image, filepath: str, image_format: str) -> dict :
+    start = time.perf_counter()
+    encoding = 'rgba'
+    with stage('encode'):
+        if image_format == 'webp' :
+            buffer = io.BytesIO()
+            im.save(buffer, 'WEBP', lossless=True, quality=100, method=6, exact=True)
+            data = buffer.getvalue()
+        else:
+            palette = to_palette(im) if image_format == 'png-palette' else None
+            if palette is not None :
+                encoding = 'palette'
+                data = encode_png(palette, True)
+            else:
+                data = encode_png(im, image_format != 'png')
+    with stage('write'):
+        with open_file(filepath, 'wb') as f:
+            f.write(data)
+    return {
+        'format': image_format,
+        'encoding': encoding,
+        'bytes': len(data),
+        'raw_bytes': im.size[0] * im.size[1] * 4,
+        'seconds': round(time.perf_counter() - start, 4)
+    }
 
 
 phi = (1 + 5 ** 0.5) / 2
@@ -36,35 +173,233 @@ class spritesheet:
         self._grid_height = math.ceil(self._capacity / self._grid_width)
         self._current_x = 0
         self._current_y = 0
-        self._im = Image.new('RGBA', (self._grid_width * self._sprite_width, self._grid_height * self._sprite_height))
+        self._sprites: list[tuple[str, tuple[int, int]]] = []
+        self._hashes: dict[str, str] = {}
+        self._aliases: dict[str, list[int]] = {}
 
-    def add_sprite(self, sprite_path: str) -> tuple[int, int] :
+    def add_sprite(self, sprite_path: str, digest: str | None = None) -> tuple[int, int] :
         if self._current_x >= self._grid_width :
             self._current_x = 0
             self._current_y += 1
         if self._current_y >= self._grid_height :
             raise RuntimeError('Spritesheet exceeded capacity')
         res = (self._current_x, self._current_y)
-        offset = (self._sprite_width * self._current_x, self._sprite_height * self._current_y)
+        self._sprites.append((sprite_path, res))
+        if digest is not None :
+            self._hashes[sprite_path] = digest
+        self._current_x += 1
+        return res
+
+    def add_alias(self, sprite_path: str, cell: tuple[int, int]):
+        # Sprite that is not pasted because it is identical to the one in the given cell
+        self._aliases[sprite_path] = list(cell)
+
+    def _paste(self, im: Image.Image, sprite_path: str, cell: tuple[int, int]):
+        offset = (self._sprite_width * cell[0], self._sprite_height * cell[1])
+        count_file('rb')
         with Image.open(sprite_path) as sprite:
             if sprite.size != (self._sprite_width, self._sprite_height) :
                 raise RuntimeError(f"Sprite at {sprite_path} has dimensions {sprite.size}, expected {(self._sprite_width, self._sprite_height)}")
-            self._im.paste(sprite, offset)
-        self._current_x += 1
-        return res
+            im.paste(sprite, offset)
 
-    def write(self, filepath: str):
-        self._im.save(filepath)
-        print(f"Spritesheet saved at {filepath}")
+    def _clear(self, im: Image.Image, cell: tuple[int, int]):
+        offset = (self._sprite_width * cell[0], self._sprite_height * cell[1])
+        im.paste((0, 0, 0, 0), offset + (offset[0] + self._sprite_width, offset[1] + self._sprite_height))
+
+    def _paste_all(self, im: Image.Image, sprites: list[tuple[str, tuple[int, int]]], pool: Executor | None):
+        if pool is None :
+            for path, cell in sprites :
+                self._paste(im, path, cell)
+            return
+        sprite_size = (self._sprite_width, self._sprite_height)
+        paths = [x[0] for x in sprites]
+        decoded = pool.map(decode_sprite, paths, [sprite_size] * len(paths), chunksize=64)
+        for (path, cell), data in zip(sprites, decoded) :
+            offset = (self._sprite_width * cell[0], self._sprite_height * cell[1])
+            im.paste(Image.frombytes('RGBA', sprite_size, data), offset)
+
+    def write(self, filepath: str, manifest: sprite_manifest, pool: Executor | None = None, image_format: str = 'png') -> tuple[dict, dict | None] :
+        # Returns the report along with the manifest entry of the sheet if it changed, the manifest itself is only read
+        sheet_name = os.path.relpath(filepath, dest_dir)
+        size = (self._grid_width * self._sprite_width, self._grid_height * self._sprite_height)
+        missing = [x[0] for x in self._sprites if x[0] not in self._hashes]
+        computed = pool.map(file_hash, missing, chunksize=64) if pool is not None else map(file_hash, missing)
+        self._hashes.update(zip(missing, computed))
+        hashes = [self._hashes[x[0]] for x in self._sprites]
+        cells = [{ 'path': path, 'hash': digest, 'cell': list(cell) } for (path, cell), digest in zip(self._sprites, hashes)]
+        sheet = { 'size': list(size), 'sprite_size': [self._sprite_width, self._sprite_height], 'format': image_format, 'cells': cells }
+        if len(self._aliases) > 0 :
+            sheet['aliases'] = self._aliases
+        previous = manifest.get(sheet_name)
+        if previous is not None and previous['size'] == sheet['size'] and previous['sprite_size'] == sheet['sprite_size'] and os.path.isfile(filepath) :
+            # Same grid: only the cells whose sprite changed (or moved) are pasted again
+            count_file('rb')
+            with Image.open(filepath) as existing:
+                im = existing.convert('RGBA')
+            changed = [(entry['path'], tuple(entry['cell'])) for idx, entry in enumerate(cells) if idx >= len(previous['cells']) or previous['cells'][idx] != entry]
+            with stage('paste'):
+                self._paste_all(im, changed, pool)
+            for entry in previous['cells'][len(cells):] :
+                self._clear(im, tuple(entry['cell']))
+            changed = len(changed) + max(len(previous['cells']) - len(cells), 0)
+            if changed == 0 and previous.get('format', 'png') == image_format :
+                print(f"Spritesheet at {filepath} is up to date")
+                return { 'format': image_format, 'bytes': os.path.getsize(filepath), 'skipped': True }, sheet if previous != sheet else None
+            print(f"Updated {changed} cell(s) in spritesheet {filepath}")
+        else:
+            im = Image.new('RGBA', size)
+            with stage('paste'):
+                self._paste_all(im, self._sprites, pool)
+        report = encode_image(im, filepath, image_format)
+        print(f"Spritesheet saved at {filepath} ({report['encoding']} {image_format}, {report['bytes']} bytes in {report['seconds']:.2f}s)")
+        return report, sheet
 
 
-def make_type_spritesheet(sprite_name: str, sprite_size: tuple[int, int], spritesheet_name: str, has_text: bool, css_classes: list[str], stylesheet: list[str]) :
+def write_if_changed(filepath: str, content: str) -> bool :
+    if os.path.isfile(filepath) :
+        with open_file(filepath, 'r') as f:
+            if f.read() == content :
+                return False
+    with open_file(filepath, 'w') as f:
+        f.write(content)
+    return True
+
+
+def write_spritesheets(sheets: list[tuple[spritesheet, str]], manifest: sprite_manifest, pool: Executor | None, image_format: str) -> dict[str, dict] :
+    if pool is None :
+        results = [sheet.write(filepath, manifest, None, image_format) for sheet, filepath in sheets]
+    else:
+        # Sprites are decoded in worker processes while every sheet is assembled in its own thread,
+        # cells are disjoint so the result does not depend on the order in which they are pasted
+        with ThreadPoolExecutor(len(sheets)) as threads:
+            futures = [threads.submit(instrumentation.propagate(sheet.write), filepath, manifest, pool, image_format) for sheet, filepath in sheets]
+            results = [x.result() for x in futures]
+    # The manifest is updated in the order of the sheets, regardless of the order in which the threads finish
+    reports: dict[str, dict] = {}
+    for (_, filepath), (report, entry) in zip(sheets, results) :
+        sheet_name = os.path.relpath(filepath, dest_dir)
+        if entry is not None :
+            manifest.set(sheet_name, entry)
+        reports[sheet_name] = report
+    return reports
+
+
+def remove_stale_spritesheets(sheets: list[tuple[spritesheet, str]], manifest: sprite_manifest, ext: str):
+    # Sheets left by a previous run with another --format, found next to the current ones and in the manifest
+    stale = { os.path.splitext(filepath)[0] + f".{x}" for _, filepath in sheets for x in set(image_extensions.values()) if x != ext }
+    stale.update(os.path.join(dest_dir, x) for x in manifest.sheet_names() if os.path.splitext(x)[1] != f".{ext}")
+    for filepath in sorted(stale) :
+        manifest.remove(os.path.relpath(filepath, dest_dir))
+        if os.path.isfile(filepath) :
+            os.remove(filepath)
+            print(f"Removed stale spritesheet {filepath}")
+
+
+def make_icon_spritesheets(sprites: dict[str, list[str]], digests: dict[str, tuple[str, str]], dedup: bool, directory: str, ext: str) -> tuple[list[tuple[spritesheet, str]], list[tuple[list[str], tuple[int, int]]]] :
+    # Common and shiny sprites share the same cell, so they can only be merged if both are identical
+    cells: dict[tuple[str, str] | str, list[str]] = {}
+    unique_sprites: dict[tuple[str, str] | str, str] = {}
+    sprite_keys: dict[str, tuple[str, str] | str] = {}
+    for filename, css_classes in sprites.items() :
+        key = (digests[os.path.join(common_sprites_dir, f"{filename}.png")][1], digests[os.path.join(shiny_sprites_dir, f"{filename}.png")][1])
+        if not dedup :
+            key = filename
+        sprite_keys[filename] = key
+        unique_sprites.setdefault(key, filename)
+        cells.setdefault(key, []).extend(css_classes)
+
+    common_spritesheet = spritesheet(len(unique_sprites) + 1, icon_sprite_size)
+    shiny_spritesheet = spritesheet(len(unique_sprites) + 1, icon_sprite_size)
+    common_spritesheet.add_sprite(unknown_sprite_path, digests[unknown_sprite_path][0])
+    shiny_spritesheet.add_sprite(unknown_sprite_path, digests[unknown_sprite_path][0])
+
+    placements: list[tuple[list[str], tuple[int, int]]] = []
+    offsets: dict[tuple[str, str] | str, tuple[int, int]] = {}
+    for key, filename in unique_sprites.items() :
+        common_path = os.path.join(common_sprites_dir, f"{filename}.png")
+        shiny_path = os.path.join(shiny_sprites_dir, f"{filename}.png")
+        offset = common_spritesheet.add_sprite(common_path, digests[common_path][0])
+        shiny_spritesheet.add_sprite(shiny_path, digests[shiny_path][0])
+        placements.append((cells[key], offset))
+        offsets[key] = offset
+    for filename in sprites :
+        key = sprite_keys[filename]
+        if unique_sprites[key] != filename :
+            common_spritesheet.add_alias(os.path.join(common_sprites_dir, f"{filename}.png"), offsets[key])
+            shiny_spritesheet.add_alias(os.path.join(shiny_sprites_dir, f"{filename}.png"), offsets[key])
+
+    saved_cells = len(sprites) - len(unique_sprites)
+    if saved_cells > 0 :
+        saved_bytes = 2 * saved_cells * icon_sprite_size[0] * icon_sprite_size[1] * 4
+        kept = set(unique_sprites.values())
+        saved_files = sum(os.path.getsize(os.path.join(x, f"{filename}.png")) for filename in sprites if filename not in kept for x in [common_sprites_dir, shiny_sprites_dir])
+        print(f"Deduplicated {saved_cells} sprite(s) out of {len(sprites)} in {directory}: saved {saved_cells} cell(s) per sheet, {saved_bytes} bytes of pixel data ({saved_files} bytes of source PNG)")
+
+    sheets = [
+        (common_spritesheet, os.path.join(directory, f"common.{ext}")),
+        (shiny_spritesheet, os.path.join(directory, f"shiny.{ext}"))
+    ]
+    return sheets, placements
+
+def make_icon_shards(sprites: dict[str, list[str]], sprite_shards: dict[str, str], digests: dict[str, tuple[str, str]], dedup: bool, ext: str) -> list[tuple[spritesheet, str]] :
+    shards: dict[str, dict[str, list[str]]] = {}
+    for filename, css_classes in sprites.items() :
+        shards.setdefault(sprite_shards[filename], {})[filename] = css_classes
+    sheets: list[tuple[spritesheet, str]] = []
+    loader_manifest: dict[str, dict] = { 'sprite_size': list(icon_sprite_size), 'shards': {}, 'sprites': {} }
+    if os.path.isdir(shards_dest_dir) :
+        # Remove the shards left by a previous run with a different partitioning
+        for entry in os.scandir(shards_dest_dir) :
+            if entry.is_dir() and entry.name not in shards :
+                shutil.rmtree(entry.path)
+    for shard_name, shard_sprites in sorted(shards.items()) :
+        shard_dir = os.path.join(shards_dest_dir, shard_name)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_sheets, placements = make_icon_spritesheets(shard_sprites, digests, dedup, shard_dir, ext)
+        sheets.extend(shard_sheets)
+        # Rules are prefixed by the element name to take precedence over the ones in the main stylesheet
+        selectors = [x for css_classes, _ in placements for x in css_classes]
+        shard_stylesheet = [
+            ", ".join(f"span{x}" for x in selectors) + f" {{ background-image: url('common.{ext}'); }}",
+            ", ".join(f"span{x}.shiny" for x in selectors) + f" {{ background-image: url('shiny.{ext}'); }}"
+        ]
+        for css_classes, offset in placements :
+            css_classes_str = ", ".join(f"span{x}, img{x}" for x in css_classes)
+            shard_stylesheet.append(f"{css_classes_str} {{ --psprite-x: {offset[0]}; --psprite-y: {offset[1]}; }}")
+            for css_class in css_classes :
+                loader_manifest['sprites'][css_class[len(icon_sprite_class):]] = { 'shard': shard_name, 'cell': list(offset) }
+        shard_stylesheet_dest = os.path.join(shard_dir, 'styles.css')
+        if write_if_changed(shard_stylesheet_dest, "\n".join(shard_stylesheet)) :
+            print(f"Stylesheet saved at {shard_stylesheet_dest}")
+        loader_manifest['shards'][shard_name] = {
+            'common': f"{shard_name}/common.{ext}",
+            'shiny': f"{shard_name}/shiny.{ext}",
+            'css': f"{shard_name}/styles.css",
+            'sprites': len(shard_sprites)
+        }
+    loader_manifest_path = os.path.join(shards_dest_dir, 'shards.json')
+    if write_if_changed(loader_manifest_path, json.dumps(loader_manifest, indent=4)) :
+        print(f"Shard manifest saved at {loader_manifest_path}")
+    return sheets
+
+
+def remove_shards(manifest: sprite_manifest):
+    # Shards left by a previous run with --shard-by-gen or --shard-size, which would no longer be updated
+    shards_prefix = os.path.relpath(shards_dest_dir, dest_dir) + os.sep
+    for sheet_name in manifest.sheet_names() :
+        if sheet_name.startswith(shards_prefix) :
+            manifest.remove(sheet_name)
+    if os.path.isdir(shards_dest_dir) :
+        shutil.rmtree(shards_dest_dir)
+        print(f"Removed shards in {shards_dest_dir}")
+
+
+def make_type_spritesheet(pkmn_types: list[str], sprite_name: str, sprite_size: tuple[int, int], spritesheet_name: str, has_text: bool, css_classes: list[str], stylesheet: list[str], ext: str) -> tuple[spritesheet, str] :
     language_subpaths = [f"{x}/" for x in languages] if has_text else ['']
     type_spritesheet = spritesheet(len(language_subpaths) * len(pkmn_types), sprite_size, len(language_subpaths))
     for typ in pkmn_types:
         for lang in language_subpaths:
             type_spritesheet.add_sprite(os.path.join(sprites_base_dir, f"types/{typ}/{lang}{sprite_name}.png"))
-    type_spritesheet.write(os.path.join(dest_dir, f"{spritesheet_name}.png"))
     css_classes_str = ".".join(css_classes)
     stylesheet.extend([
         f"span{type_sprite_class}.{css_classes_str}, img{type_sprite_class}.{css_classes_str} {{ " +
@@ -72,7 +407,7 @@ def make_type_spritesheet(sprite_name: str, sprite_size: tuple[int, int], sprite
             f"height: {sprite_size[1]}px; " +
         "}",
         f"span{type_sprite_class}.{css_classes_str} {{ " +
-            f"background: url('{spritesheet_name}.png'); " +
+            f"background: url('{spritesheet_name}.{ext}'); " +
             f"background-position: calc(-1 * var(--psprite-x) * {sprite_size[0]}px) calc(-1 * var(--psprite-y) * {sprite_size[1]}px); " +
         "}",
         f"img{type_sprite_class}.{css_classes_str} {{ " +
@@ -80,16 +415,35 @@ def make_type_spritesheet(sprite_name: str, sprite_size: tuple[int, int], sprite
             f"object-position: calc(-1 * var(--psprite-x) * {sprite_size[0]}px) calc(-1 * var(--psprite-y) * {sprite_size[1]}px); " +
         "}"
     ])
+    return type_spritesheet, os.path.join(dest_dir, f"{spritesheet_name}.{ext}")
 
 
 
-def main():
-    os.makedirs(dest_dir, exist_ok=True)
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace :
+    parser = argparse.ArgumentParser(description='Generates the spritesheets and the associated CSS styles')
+    parser.add_argument('--force', action='store_true', help='ignore the sprite manifest and rebuild all spritesheets from scratch')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false', help='give every sprite file its own cell, even if its pixels are identical to another one')
+    shard_group = parser.add_mutually_exclusive_group()
+    shard_group.add_argument('--shard-by-gen', action='store_true', help=f"also emit icon spritesheets split by generation in {shards_dest_dir}")
+    shard_group.add_argument('--shard-size', type=int, metavar='N', help=f"also emit icon spritesheets split in ranges of N Pokédex numbers in {shards_dest_dir}")
+    parser.add_argument('--format', choices=list(image_extensions.keys()), default='png', help='encoding of the generated sheets: default PNG, PNG with maximum compression, PNG with a lossless palette whenever the colours fit, or lossless WebP (default: png)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used to decode sprites, 0 to use all cores (default: 1, serial)')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.shard_size is not None and args.shard_size <= 0 :
+        parser.error('--shard-size must be positive')
+    return args
 
-    pokemon_data = load_groups()
+def generate(pokemon_data: list[pkmn_group], pkmn_types: list[str], args: argparse.Namespace) -> int :
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    ext = image_extensions[args.format]
+
+    os.makedirs(dest_dir, exist_ok=True)
+    manifest = sprite_manifest(os.path.join(dest_dir, 'manifest.json'), args.force)
 
     # Associate sprites (filenames) with CSS classes
     sprites: dict[str, list[str]] = {}
+    sprite_origins: dict[str, tuple[int, int]] = {} # group number, gen
     for group in pokemon_data:
         first = True
         group_css_class = f"{icon_sprite_class}.n{group.number:04d}"
@@ -116,8 +470,10 @@ def main():
                 if female_sprite_name is not None :
                     female_css_classes.append(f"{group_css_class}.female.{form.variant}")
             sprites[sprite_name] = css_classes
+            sprite_origins[sprite_name] = (group.number, form.gen)
             if female_sprite_name is not None :
                 sprites[female_sprite_name] = female_css_classes
+                sprite_origins[female_sprite_name] = (group.number, form.gen)
             first = False
 
     stylesheet: list[str] = [
@@ -136,49 +492,79 @@ def main():
             "margin-top: -16px; " +
         "}",
         f"span{icon_sprite_class} {{ " +
-            "background: url('common.png'); " +
+            f"background: url('common.{ext}'); " +
             f"background-position: calc(-1 * var(--psprite-x) * {icon_sprite_size[0]}px) calc(-1 * var(--psprite-y) * {icon_sprite_size[1]}px); " +
         "}",
-        f"span{icon_sprite_class}.shiny {{ background-image: url('shiny.png'); }}",
+        f"span{icon_sprite_class}.shiny {{ background-image: url('shiny.{ext}'); }}",
         f"img{icon_sprite_class} {{ " +
             "object-fit: none; " +
             f"object-position: calc(-1 * var(--psprite-x) * {icon_sprite_size[0]}px) calc(-1 * var(--psprite-y) * {icon_sprite_size[1]}px); " +
         "}"
     ]
 
-    make_type_spritesheet('logo_g8', (128, 128), 'type_logos_g8', False, ['logo', 'g8'], stylesheet)
-    make_type_spritesheet('logo_g9', (64, 64), 'type_logos_g9', False, ['logo', 'g9'], stylesheet)
-    make_type_spritesheet('icon_g3', (32, 14), 'type_icons_g3', True, ['icon', 'g3'], stylesheet)
-    make_type_spritesheet('icon_g4', (32, 12), 'type_icons_g4', True, ['icon', 'g4'], stylesheet)
-    make_type_spritesheet('icon_g4_pokedex', (48, 16), 'type_icons_g4_pokedex', True, ['icon', 'g4', 'pokedex'], stylesheet)
-    make_type_spritesheet('icon_g5', (32, 14), 'type_icons_g5', True, ['icon', 'g5'], stylesheet)
-    make_type_spritesheet('icon_g6', (50, 18), 'type_icons_g6', True, ['icon', 'g6'], stylesheet)
-    make_type_spritesheet('icon_g7', (48, 18), 'type_icons_g7', True, ['icon', 'g7'], stylesheet)
-    make_type_spritesheet('icon_g8', (200, 44), 'type_icons_g8', True, ['icon', 'g8'], stylesheet)
-    make_type_spritesheet('icon_g9', (200, 40), 'type_icons_g9', True, ['icon', 'g9'], stylesheet)
-
-    stylesheet.extend(f"{type_sprite_class}.{type} {{ --psprite-y: {idx};  }}" for idx, type in enumerate(list(pkmn_types.keys())[1:], start=1))
+    sheets: list[tuple[spritesheet, str]] = []
+    sheets.append(make_type_spritesheet(pkmn_types, 'logo_g8', (128, 128), 'type_logos_g8', False, ['logo', 'g8'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'logo_g9', (64, 64), 'type_logos_g9', False, ['logo', 'g9'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g3', (32, 14), 'type_icons_g3', True, ['icon', 'g3'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g4', (32, 12), 'type_icons_g4', True, ['icon', 'g4'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g4_pokedex', (48, 16), 'type_icons_g4_pokedex', True, ['icon', 'g4', 'pokedex'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g5', (32, 14), 'type_icons_g5', True, ['icon', 'g5'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g6', (50, 18), 'type_icons_g6', True, ['icon', 'g6'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g7', (48, 18), 'type_icons_g7', True, ['icon', 'g7'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g8', (200, 44), 'type_icons_g8', True, ['icon', 'g8'], stylesheet, ext))
+    sheets.append(make_type_spritesheet(pkmn_types, 'icon_g9', (200, 40), 'type_icons_g9', True, ['icon', 'g9'], stylesheet, ext))
+
+    stylesheet.extend(f"{type_sprite_class}.{type} {{ --psprite-y: {idx};  }}" for idx, type in enumerate(pkmn_types[1:], start=1))
     stylesheet.extend(f"{type_sprite_class}.icon.{type} {{ --psprite-x: {idx};  }}" for idx, type in enumerate(languages[1:], start=1))
 
 
-    common_spritesheet = spritesheet(len(sprites), icon_sprite_size)
-    shiny_spritesheet = spritesheet(len(sprites), icon_sprite_size)
-    common_spritesheet.add_sprite(unknown_sprite_path)
-    shiny_spritesheet.add_sprite(unknown_sprite_path)
+    with ProcessPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        sprite_paths = [unknown_sprite_path]
+        for filename in sprites :
+            sprite_paths.append(os.path.join(common_sprites_dir, f"{filename}.png"))
+            sprite_paths.append(os.path.join(shiny_sprites_dir, f"{filename}.png"))
+        with stage('hash'):
+            digests = manifest.pixel_hashes(sprite_paths, pool)
 
-    for filename, css_classes in sprites.items() :
-        offset = common_spritesheet.add_sprite(os.path.join(common_sprites_dir, f"{filename}.png"))
-        shiny_spritesheet.add_sprite(os.path.join(shiny_sprites_dir, f"{filename}.png"))
-        css_classes_str = ", ".join(css_classes)
-        stylesheet.append(f"{css_classes_str} {{ --psprite-x: {offset[0]}; --psprite-y: {offset[1]}; }}")
+        icon_sheets, placements = make_icon_spritesheets(sprites, digests, args.dedup, dest_dir, ext)
+        sheets.extend(icon_sheets)
+        for css_classes, offset in placements :
+            css_classes_str = ", ".join(css_classes)
+            stylesheet.append(f"{css_classes_str} {{ --psprite-x: {offset[0]}; --psprite-y: {offset[1]}; }}")
+        if args.shard_by_gen :
+            sheets.extend(make_icon_shards(sprites, { x: f"gen{y[1]}" for x, y in sprite_origins.items() }, digests, args.dedup, ext))
+        elif args.shard_size is not None :
+            shard_names = {}
+            for filename, (number, _) in sprite_origins.items() :
+                start = ((number - 1) // args.shard_size) * args.shard_size + 1
+                shard_names[filename] = f"n{start:04d}-{start + args.shard_size - 1:04d}"
+            sheets.extend(make_icon_shards(sprites, shard_names, digests, args.dedup, ext))
+        else:
+            remove_shards(manifest)
 
-    common_spritesheet.write(os.path.join(dest_dir, 'common.png'))
-    shiny_spritesheet.write(os.path.join(dest_dir, 'shiny.png'))
+        with stage('sheets'):
+            report = write_spritesheets(sheets, manifest, pool, args.format)
+    remove_stale_spritesheets(sheets, manifest, ext)
+    manifest.write(args.format)
+    report_dest = os.path.join(dest_dir, 'report.json')
+    # The report is left untouched when no sheet was encoded again
+    if any(not x.get('skipped', False) for x in report.values()) or not os.path.isfile(report_dest) :
+        with open_file(report_dest, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Encoding report saved at {report_dest}")
     stylesheet_dest = os.path.join(dest_dir, 'styles.css')
-    with open(stylesheet_dest, 'w') as f:
-        f.write("\n".join(stylesheet))
-    print(f"Stylesheet saved at {stylesheet_dest}")
-    
+    if write_if_changed(stylesheet_dest, "\n".join(stylesheet)) :
+        print(f"Stylesheet saved at {stylesheet_dest}")
+    else:
+        print(f"Stylesheet at {stylesheet_dest} is up to date")
+    return 0
+
+def main(argv: list[str] | None = None) -> int :
+    args = parse_args(argv)
+    instrumentation.configure(args)
+    with stage('spritesheets'):
+        return generate(load_groups(), list(load_types().keys()), args)
+
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import os
+import sys
+import sqlite3
+import hashlib
+import argparse
+import contextlib
+
+import instrumentation
+from instrumentation import open_file, stage
+import pokemon_data
+from pokemon_data import atomic_write, load_groups, load_types, pkmn_group, pkmn_type, pkmn_index, pkmn_evolutions, type_chart
+
+
+dest_dir = 'generated'
+database_name = 'pokemon.db'
+
+schema = """
+CREATE TABLE metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE types (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    name_en TEXT NOT NULL,
+    name_fr TEXT NOT NULL,
+    colour TEXT NOT NULL
+);
+
+CREATE TABLE type_matchups (
+    attacker INTEGER NOT NULL REFERENCES types(id),
+    defender INTEGER NOT NULL REFERENCES types(id),
+    multiplier REAL NOT NULL,
+    PRIMARY KEY (attacker, defender)
+) WITHOUT ROWID;
+
+CREATE TABLE groups (
+    number INTEGER PRIMARY KEY,
+    evolves_from INTEGER REFERENCES groups(number),
+    family INTEGER REFERENCES groups(number),
+    stage INTEGER,
+    common_name_en TEXT,
+    common_name_fr TEXT
+);
+
+CREATE TABLE forms (
+    id INTEGER PRIMARY KEY,
+    number INTEGER NOT NULL REFERENCES groups(number),
+    position INTEGER NOT NULL,
+    variant TEXT,
+    gen INTEGER NOT NULL,
+    name_en TEXT NOT NULL,
+    name_fr TEXT NOT NULL,
+    bulbapedia TEXT NOT NULL,
+    pokepedia TEXT NOT NULL,
+    gender_variant INTEGER NOT NULL,
+    gender_ratio TEXT,
+    temporary INTEGER NOT NULL,
+    UNIQUE (number, position)
+);
+
+CREATE TABLE form_types (
+    form_id INTEGER NOT NULL REFERENCES forms(id),
+    slot INTEGER NOT NULL,
+    type_id INTEGER NOT NULL REFERENCES types(id),
+    PRIMARY KEY (form_id, slot)
+) WITHOUT ROWID;
+
+CREATE TABLE derivations (
+    form_id INTEGER NOT NULL REFERENCES forms(id),
+    from_form_id INTEGER NOT NULL REFERENCES forms(id),
+    battle_only INTEGER NOT NULL,
+    PRIMARY KEY (form_id, from_form_id)
+) WITHOUT ROWID;
+
+CREATE TABLE evolutions (
+    from_form_id INTEGER NOT NULL REFERENCES forms(id),
+    to_form_id INTEGER NOT NULL REFERENCES forms(id),
+    PRIMARY KEY (from_form_id, to_form_id)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE names USING fts5(
+    name_en, name_fr,
+    content='forms', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+indexes = """
+CREATE UNIQUE INDEX forms_number_variant ON forms(number, variant);
+CREATE INDEX forms_variant ON forms(variant);
+CREATE INDEX forms_gen ON forms(gen);
+CREATE INDEX form_types_type ON form_types(type_id, form_id);
+CREATE INDEX groups_evolves_from ON groups(evolves_from);
+CREATE INDEX groups_family ON groups(family);
+CREATE INDEX evolutions_to ON evolutions(to_form_id);
+CREATE INDEX derivations_from ON derivations(from_form_id);
+"""
+
+
+# The database is rebuilt when the data or the code that produces it changes
+source_files = ['pokemon.json', 'types.json', __file__, pokemon_data.__file__]
+
+def source_digest(filenames: list[str]) -> str :
+    hasher = hashlib.sha256()
+    for filename in filenames :
+        with open_file(filename, 'rb') as f:
+            hasher.update(hashlib.sha256(f.read()).digest())
+    hasher.update(hashlib.sha256(schema.encode() + indexes.encode()).digest())
+    return hasher.hexdigest()
+
+def stored_digest(path: str) -> str | None :
+    if not os.path.isfile(path) :
+        return None
+    try:
+        with contextlib.closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as db:
+            row = db.execute("SELECT value FROM metadata WHERE key = 'source_digest'").fetchone()
+        return row[0] if row is not None else None
+    except sqlite3.Error:
+        return None
+
+
+def insert_types(db: sqlite3.Connection, pkmn_types: dict[str, pkmn_type]) -> dict[str, int] :
+    type_ids = { x: i for i, x in enumerate(pkmn_types.keys()) }
+    db.executemany(
+        "INSERT INTO types (id, name, name_en, name_fr, colour) VALUES (?, ?, ?, ?, ?)",
+        ((type_ids[x], x, y.names.en, y.names.fr, y.colour) for x, y in pkmn_types.items())
+    )
+    chart = type_chart(pkmn_types)
+    matchups = []
+    for attacker in chart.type_ids :
+        for defender in chart.type_ids :
+            matchups.append((type_ids[attacker], type_ids[defender], chart.multiplier(attacker, defender)))
+    db.executemany("INSERT INTO type_matchups (attacker, defender, multiplier) VALUES (?, ?, ?)", matchups)
+    return type_ids
+
+def insert_groups(db: sqlite3.Connection, pokemon_data: list[pkmn_group], type_ids: dict[str, int]) -> int :
+    evolutions = pkmn_evolutions(pkmn_index(pokemon_data))
+    form_ids: dict[tuple[int, str | None], int] = {}
+    group_rows = []
+    form_rows = []
+    form_type_rows = []
+    for group in pokemon_data :
+        group_rows.append((
+            group.number,
+            group.evolves_from,
+            evolutions.root(group.number),
+            evolutions.stage(group.number),
+            group.common_names.en if group.common_names is not None else None,
+            group.common_names.fr if group.common_names is not None else None
+        ))
+        for position, form in enumerate(group.forms) :
+            form_id = len(form_rows) + 1
+            form_ids[(group.number, form.variant)] = form_id
+            form_rows.append((
+                form_id, group.number, position, form.variant, form.gen,
+                form.names.en, form.names.fr, form.links.bulbapedia, form.links.pokepedia,
+                form.gender_variant, form.gender_ratio.value if form.gender_ratio is not None else None,
+                form.is_temporary()
+            ))
+            form_type_rows.extend((form_id, slot, type_ids[x]) for slot, x in enumerate(form.types))
+
+    derivation_rows = []
+    evolution_rows = []
+    for group in pokemon_data :
+        pre_number = evolutions.parent(group.number)
+        for form in group.forms :
+            form_id = form_ids[(group.number, form.variant)]
+            if form.derives is not None :
+                derivation_rows.extend((form_id, form_ids[(group.number, x)], form.derives.battle_only) for x in form.derives.from_variants)
+            evolution_rows.extend((form_ids[(pre_number, x)], form_id) for x in evolutions.pre_evolution_variants(group, form))
+
+    db.executemany("INSERT INTO groups (number, evolves_from, family, stage, common_name_en, common_name_fr) VALUES (?, ?, ?, ?, ?, ?)", group_rows)
+    db.executemany(
+        "INSERT INTO forms (id, number, position, variant, gen, name_en, name_fr, bulbapedia, pokepedia, gender_variant, gender_ratio, temporary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        form_rows
+    )
+    db.executemany("INSERT INTO form_types (form_id, slot, type_id) VALUES (?, ?, ?)", form_type_rows)
+    db.executemany("INSERT INTO derivations (form_id, from_form_id, battle_only) VALUES (?, ?, ?)", derivation_rows)
+    db.executemany("INSERT INTO evolutions (from_form_id, to_form_id) VALUES (?, ?)", evolution_rows)
+    db.execute("INSERT INTO names (names) VALUES ('rebuild')")
+    return len(form_rows)
+
+
+def generate(pokemon_data: list[pkmn_group], pkmn_types: dict[str, pkmn_type], force: bool = False) -> int :
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, database_name)
+    digest = source_digest(source_files)
+    if not force and stored_digest(path) == digest :
+        print(f"Database at {path} is up to date")
+        return 0
+
+    # The database is built aside in a file of its own and swapped in, so that readers never see a partial file
+    with atomic_write(path, 'wb') as f:
+        db = sqlite3.connect(f.name)
+        try:
+            db.execute('PRAGMA journal_mode = OFF')
+            db.execute('PRAGMA synchronous = OFF')
+            with stage('insert'), db:
+                db.executescript(schema)
+                type_ids = insert_types(db, pkmn_types)
+                form_count = insert_groups(db, pokemon_data, type_ids)
+                db.executescript(indexes)
+                db.execute("INSERT INTO metadata (key, value) VALUES ('source_digest', ?)", (digest,))
+            with stage('vacuum'):
+                db.execute('ANALYZE')
+                db.execute('VACUUM')
+        finally:
+            db.close()
+    print(f"Database with {len(pokemon_data)} groups and {form_count} forms saved at {path}")
+    return 0
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Exports the data to a normalized SQLite database with full-text search on names')
+    parser.add_argument('--force', action='store_true', help='rebuild the database even if the data did not change')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure(args)
+    with stage('sqlite'):
+        return generate(load_groups(), load_types(), args.force)
+
+if __name__ == '__main__':
+    sys.exit(main())
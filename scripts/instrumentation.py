@@ -0,0 +1,304 @@
+
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import argparse
+import cProfile
+import contextvars
+import platform
+import resource
+import threading
+import functools
+import contextlib
+import tracemalloc
+
+from typing import Callable
+
+
+report_env_var = 'POKEMON_PROFILE'
+cprofile_env_var = 'POKEMON_PROFILE_CPROFILE'
+tracemalloc_env_var = 'POKEMON_PROFILE_TRACEMALLOC'
+
+thread_io_path = '/proc/thread-self/io'
+
+
+def thread_io() -> dict[str, int] | None :
+    # Linux only, read with os.read so that the counters do not count themselves as an opened file,
+    # the size of the content is kept so that reading the counters can be left out of them
+    try:
+        fd = os.open(thread_io_path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        content = os.read(fd, 4096).decode()
+    finally:
+        os.close(fd)
+    res = { 'self': len(content) }
+    for line in content.splitlines() :
+        name, value = line.split(':', 1)
+        res[name] = int(value)
+    return res
+
+
+class stage_stats:
+    def __init__(self, path: str):
+        self.path = path
+        self.calls = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.files_read = 0
+        self.files_written = 0
+        self.bytes_read: int | None = None
+        self.bytes_written: int | None = None
+        self.memory_peak = 0
+        self.profiles: list[cProfile.Profile] = []
+
+    def to_json(self) -> dict :
+        res = {
+            'name': self.path,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'files_read': self.files_read,
+            'files_written': self.files_written
+        }
+        if self.bytes_read is not None :
+            res['bytes_read'] = self.bytes_read
+            res['bytes_written'] = self.bytes_written
+        if tracemalloc.is_tracing() :
+            res['tracemalloc_peak_kb'] = self.memory_peak // 1024
+        return res
+
+class active_stage:
+    __slots__ = ('stats', 'start', 'start_cpu', 'start_io', 'start_overhead', 'files_read', 'files_written', 'memory_peak', 'profile')
+
+    def __init__(self, stats: stage_stats, start_io: dict[str, int] | None, start_overhead: int):
+        self.stats = stats
+        self.files_read = 0
+        self.files_written = 0
+        self.memory_peak = 0
+        self.profile: cProfile.Profile | None = None
+        self.start_io = start_io
+        self.start_overhead = start_overhead
+        self.start_cpu = time.thread_time()
+        self.start = time.perf_counter()
+
+
+class recorder:
+    # Stages are nested per thread, CPU time and I/O are those of the thread running the stage
+    def __init__(self, report_path: str, cprofile_dir: str | None, trace_memory: bool):
+        self.report_path = report_path
+        self.cprofile_dir = cprofile_dir
+        self.trace_memory = trace_memory
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.stages: dict[str, stage_stats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active: list[active_stage] = []
+
+    def _stack(self) -> list[active_stage] :
+        stack = getattr(self._local, 'stack', None)
+        if stack is None :
+            stack = []
+            self._local.stack = stack
+            self._local.io_overhead = 0
+            self._local.parent = None
+        return stack
+
+    def current_path(self) -> str | None :
+        stack = self._stack()
+        return stack[-1].stats.path if len(stack) > 0 else self._local.parent
+
+    def run_in(self, parent: str | None, fn: Callable, *args, **kwargs):
+        # Stages started by fn are nested in the given stage, even when it runs in another thread
+        self._stack()
+        previous = self._local.parent
+        self._local.parent = parent
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._local.parent = previous
+
+    def _thread_io(self) -> tuple[dict[str, int] | None, int] :
+        # Counters along with the bytes read from them by the thread before this call
+        res = thread_io()
+        overhead = self._local.io_overhead
+        if res is not None :
+            self._local.io_overhead += res['self']
+        return res, overhead
+
+    def _update_memory_peak(self):
+        # The traced peak is process wide, it is reset at every stage boundary and carried over to all running stages
+        if not tracemalloc.is_tracing() :
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for current in self._active :
+            current.memory_peak = max(current.memory_peak, peak)
+
+    def count_file(self, mode: str):
+        stack = self._stack()
+        if len(stack) > 0 :
+            if any(x in mode for x in 'wax+') :
+                stack[-1].files_written += 1
+            else:
+                stack[-1].files_read += 1
+
+    def enter(self, name: str) -> active_stage :
+        parent = self.current_path()
+        stack = self._stack()
+        path = f"{parent}/{name}" if parent is not None else name
+        start_io, start_overhead = self._thread_io()
+        with self._lock:
+            stats = self.stages.get(path)
+            if stats is None :
+                stats = stage_stats(path)
+                self.stages[path] = stats
+            self._update_memory_peak()
+            current = active_stage(stats, start_io, start_overhead)
+            self._active.append(current)
+        if self.cprofile_dir is not None and len(stack) == 0 :
+            # Only the outermost stage of each thread is profiled, nested ones appear in its call graph.
+            # Since Python 3.12, a single profiler can be active at a time: stages that start while
+            # another thread is profiled are skipped
+            current.profile = cProfile.Profile()
+            try:
+                current.profile.enable()
+            except ValueError:
+                current.profile = None
+        stack.append(current)
+        return current
+
+    def exit(self, current: active_stage):
+        if current.profile is not None :
+            current.profile.disable()
+        seconds = time.perf_counter() - current.start
+        cpu_seconds = time.thread_time() - current.start_cpu
+        end_io, end_overhead = self._thread_io()
+        stack = self._stack()
+        stack.pop()
+        if len(stack) > 0 :
+            # Files opened by a nested stage also count for the enclosing ones
+            stack[-1].files_read += current.files_read
+            stack[-1].files_written += current.files_written
+        with self._lock:
+            self._update_memory_peak()
+            self._active.remove(current)
+            stats = current.stats
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.cpu_seconds += cpu_seconds
+            stats.files_read += current.files_read
+            stats.files_written += current.files_written
+            stats.memory_peak = max(stats.memory_peak, current.memory_peak)
+            if current.start_io is not None and end_io is not None :
+                stats.bytes_read = (stats.bytes_read or 0) + end_io['rchar'] - current.start_io['rchar'] - (end_overhead - current.start_overhead)
+                stats.bytes_written = (stats.bytes_written or 0) + end_io['wchar'] - current.start_io['wchar']
+            if current.profile is not None :
+                stats.profiles.append(current.profile)
+
+    def report(self) -> dict :
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        res = {
+            'script': os.path.basename(sys.argv[0]),
+            'argv': sys.argv[1:],
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'seconds': time.perf_counter() - self.start,
+            'cpu_seconds': usage.ru_utime + usage.ru_stime,
+            'children_cpu_seconds': children.ru_utime + children.ru_stime,
+            'peak_rss_kb': usage.ru_maxrss,
+            'stages': []
+        }
+        if tracemalloc.is_tracing() :
+            res['tracemalloc_peak_kb'] = max(tracemalloc.get_traced_memory()[1], max((x.memory_peak for x in self.stages.values()), default=0)) // 1024
+        for stats in self.stages.values() :
+            entry = stats.to_json()
+            if len(stats.profiles) > 0 :
+                profile_path = os.path.join(self.cprofile_dir, stats.path.replace('/', '.') + '.prof')
+                pstats.Stats(*stats.profiles).dump_stats(profile_path)
+                entry['profile'] = profile_path
+            res['stages'].append(entry)
+        return res
+
+    def write_report(self):
+        # Worker processes forked from an instrumented script must not overwrite the report
+        if os.getpid() != self.pid :
+            return
+        report = self.report()
+        if os.path.dirname(self.report_path) != '' :
+            os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+        with open(self.report_path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Profiling report saved at {self.report_path}", file=sys.stderr)
+
+
+_recorder: recorder | None = None
+_disabled = contextlib.nullcontext()
+
+def enabled() -> bool :
+    return _recorder is not None
+
+def enable(report_path: str, cprofile_dir: str | None = None, trace_memory: bool = False):
+    global _recorder
+    if _recorder is not None :
+        return
+    if cprofile_dir is not None :
+        os.makedirs(cprofile_dir, exist_ok=True)
+    if trace_memory and not tracemalloc.is_tracing() :
+        tracemalloc.start()
+    _recorder = recorder(report_path, cprofile_dir, trace_memory)
+    atexit.register(_recorder.write_report)
+
+@contextlib.contextmanager
+def _stage(name: str):
+    current = _recorder.enter(name)
+    try:
+        yield
+    finally:
+        _recorder.exit(current)
+
+def stage(name: str) :
+    # Nearly free when instrumentation is disabled
+    if _recorder is None :
+        return _disabled
+    return _stage(name)
+
+
+def count_file(mode: str = 'r'):
+    # Files are counted where the scripts open them, including the ones opened by libraries on their behalf (e.g. images)
+    if _recorder is not None :
+        _recorder.count_file(mode)
+
+def open_file(file, mode: str = 'r', *args, **kwargs):
+    count_file(mode)
+    return open(file, mode, *args, **kwargs)
+
+
+def propagate(fn: Callable) -> Callable :
+    # Wraps a function submitted to a thread pool so that its stages are nested in the current one,
+    # it also runs in a copy of the current context (e.g. to keep the stage prefix of the pipeline output)
+    context = contextvars.copy_context()
+    if _recorder is None :
+        return functools.partial(context.run, fn)
+    return functools.partial(context.run, _recorder.run_in, _recorder.current_path(), fn)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('instrumentation', f"can also be enabled with the {report_env_var}, {cprofile_env_var} and {tracemalloc_env_var} environment variables")
+    group.add_argument('--profile', metavar='PATH', help='record the time, CPU time and I/O of every stage in a JSON report')
+    group.add_argument('--cprofile', metavar='DIR', help='with --profile, also dump a cProfile of every outermost stage in DIR')
+    group.add_argument('--tracemalloc', action='store_true', help='with --profile, also record the peak traced memory of every stage')
+
+def configure(args: argparse.Namespace | None = None):
+    report_path = getattr(args, 'profile', None) or os.environ.get(report_env_var)
+    if report_path is None or report_path == '' :
+        return
+    cprofile_dir = getattr(args, 'cprofile', None) or os.environ.get(cprofile_env_var) or None
+    trace_memory = getattr(args, 'tracemalloc', False) or os.environ.get(tracemalloc_env_var, '') not in ['', '0']
+    enable(report_path, cprofile_dir, trace_memory)
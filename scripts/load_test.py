@@ -0,0 +1,115 @@
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+from pokemon_data import load_groups
+
+
+def make_targets(count: int, sheets: bool) -> list[str] :
+    rng = random.Random(42)
+    icons = []
+    for group in load_groups() :
+        for form in group.forms :
+            target = f"/icons/{group.number}" + (f"/{form.variant}" if form.variant is not None else '')
+            icons.append(target)
+            icons.append(target + '?shiny=1')
+            if form.gender_variant :
+                icons.append(target + '?female=1')
+    res = [rng.choice(icons) for _ in range(count)]
+    if sheets :
+        res[::20] = ['/spritesheets/styles.css'] * len(res[::20])
+        res[10::20] = ['/spritesheets/common.png'] * len(res[10::20])
+    return res
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, dict[str, str], bytes] :
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split(' ')[1])
+    headers = {}
+    for line in head[1:] :
+        if ':' in line :
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', '0')))
+    return status, headers, body
+
+async def client(host: str, port: int, targets: list[str], conditional: bool, latencies: list[float], statuses: dict[int, int]):
+    # One keep-alive connection per client, remembering ETags like a browser cache would
+    reader, writer = await asyncio.open_connection(host, port)
+    etags: dict[str, str] = {}
+    try:
+        for target in targets :
+            request = f"GET {target} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            if conditional and target in etags :
+                request += f"If-None-Match: {etags[target]}\r\n"
+            start = time.perf_counter()
+            writer.write((request + "\r\n").encode('latin-1'))
+            status, headers, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if 'etag' in headers :
+                etags[target] = headers['etag']
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def wait_for_server(host: str, port: int, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while True :
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return
+        except OSError:
+            if time.perf_counter() > deadline :
+                raise
+            await asyncio.sleep(0.1)
+
+async def run(args: argparse.Namespace) -> dict :
+    await wait_for_server(args.host, args.port, 30)
+    targets = make_targets(args.requests, args.sheets)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    per_client = [targets[i::args.concurrency] for i in range(args.concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args.host, args.port, x, args.conditional, latencies, statuses) for x in per_client))
+    total = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'seconds': total,
+        'throughput': len(latencies) / total,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'statuses': statuses
+    }
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Drives the icon server with concurrent keep-alive clients and reports throughput and latency')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='port of the server (default: 8080)')
+    parser.add_argument('-n', '--requests', type=int, default=20000, help='total number of requests (default: 20000)')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='number of concurrent connections (default: 16)')
+    parser.add_argument('--conditional', action='store_true', help='send If-None-Match with the ETags received so far, as a browser cache would')
+    parser.add_argument('--sheets', action='store_true', help='mix requests for the stylesheet and the common spritesheet with the icons')
+    parser.add_argument('--spawn', action='store_true', help='start scripts/serve.py on the given port for the duration of the test')
+    args = parser.parse_args(argv)
+
+    server = subprocess.Popen([sys.executable, 'scripts/serve.py', '--host', args.host, '--port', str(args.port)], stdout=subprocess.DEVNULL) if args.spawn else None
+    try:
+        res = asyncio.run(run(args))
+    finally:
+        if server is not None :
+            server.terminate()
+            server.wait()
+    print(f"{res['requests']} requests in {res['seconds']:.2f}s over {args.concurrency} connections: {res['throughput']:,.0f} req/s, p50 {res['p50_ms']:.2f} ms, p99 {res['p99_ms']:.2f} ms")
+    print('Statuses: ' + ', '.join(f"{x}: {y}" for x, y in sorted(res['statuses'].items())))
+    return 0 if all(x in [200, 304] for x in res['statuses']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+import contextvars
+
+from typing import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import check
+import generate_html
+import generate_markdown
+import generate_mermaid
+import generate_spritesheets
+import generate_snapshot
+import generate_sqlite
+import instrumentation
+import pokemon_sprites
+from instrumentation import open_file, stage as instrumented_stage
+from pokemon_data import cache_dir, schemas_base_path, load_groups, load_types, group_validation_error, pkmn_group, pkmn_index, pkmn_type, pkmn_evolutions
+import pokemon_data
+
+
+stamps_dir = os.path.join(cache_dir, 'pipeline')
+
+current_stage: contextvars.ContextVar[str | None] = contextvars.ContextVar('current_stage', default=None)
+
+
+class pipeline_model:
+    def __init__(self, jobs: int):
+        self._jobs = jobs
+        self._lock = threading.Lock()
+        self._groups: list[pkmn_group] | None = None
+        self._types: dict[str, pkmn_type] | None = None
+        self._index: pkmn_index | None = None
+
+    def _load(self):
+        # Loaded and validated at most once, by the first stage that needs it
+        with self._lock:
+            if self._index is not None :
+                return
+            with instrumented_stage('load'):
+                self._types = load_types()
+                self._groups = load_groups(self._jobs)
+                self._index = pkmn_index(self._groups)
+
+    def groups(self) -> list[pkmn_group] :
+        self._load()
+        return self._groups
+
+    def types(self) -> list[str] :
+        self._load()
+        return list(self._types.keys())
+
+    def type_data(self) -> dict[str, pkmn_type] :
+        self._load()
+        return self._types
+
+    def index(self) -> pkmn_index :
+        self._load()
+        return self._index
+
+
+def latest_mtime(paths: list[str]) -> float :
+    res = 0.0
+    for path in paths :
+        if os.path.isdir(path) :
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames :
+                    res = max(res, os.stat(os.path.join(dirpath, filename)).st_mtime)
+        elif os.path.exists(path) :
+            res = max(res, os.stat(path).st_mtime)
+        else:
+            # A missing input can never be considered older than the outputs
+            return float('inf')
+    return res
+
+class stage:
+    def __init__(self, name: str, inputs: list[str], outputs: list[str], run: Callable[[pipeline_model], int], requires: list[str] = []):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.requires = requires
+
+    def stamp_path(self) -> str :
+        return os.path.join(stamps_dir, f"{self.name}.stamp")
+
+    def is_up_to_date(self) -> bool :
+        # Generators avoid rewriting unchanged files, so the last successful run is recorded in a stamp
+        if not os.path.isfile(self.stamp_path()) or any(not os.path.exists(x) for x in self.outputs) :
+            return False
+        return os.stat(self.stamp_path()).st_mtime > latest_mtime(self.inputs)
+
+    def mark_done(self):
+        os.makedirs(stamps_dir, exist_ok=True)
+        with open_file(self.stamp_path(), 'w') as f:
+            f.write(f"{time.time()}\n")
+
+
+class stage_output:
+    # Stands for sys.stdout while stages run concurrently, every complete line is prefixed with the stage that printed it
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def write(self, text: str) -> int :
+        lines = (getattr(self._local, 'pending', '') + text).split('\n')
+        self._local.pending = lines.pop()
+        if len(lines) > 0 :
+            name = current_stage.get()
+            prefix = f"[{name}] " if name is not None else ''
+            with self._lock:
+                self._stream.write(''.join(f"{prefix}{x}\n" for x in lines))
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+
+def run_check(model: pipeline_model) -> int :
+    logger = check.error_logger()
+    check.check_all(model.groups(), model.types(), logger)
+    return 0 if logger.ok() else 1
+
+def make_stages(jobs: int, force: bool) -> list[stage] :
+    data_inputs = ['pokemon.json', 'types.json', schemas_base_path, pokemon_data.__file__, pokemon_sprites.__file__, instrumentation.__file__]
+    spritesheets_args = ['-j', str(jobs)] + (['--force'] if force else [])
+    return [
+        stage('check', data_inputs + [check.types_sprites_dir] + list(check.icon_dirs.values()) + [check.__file__], [], run_check),
+        stage(
+            'spritesheets',
+            data_inputs + [generate_spritesheets.sprites_base_dir, generate_spritesheets.__file__],
+            [os.path.join(generate_spritesheets.dest_dir, x) for x in ['styles.css', 'manifest.json']],
+            lambda model: generate_spritesheets.generate(model.groups(), model.types(), generate_spritesheets.parse_args(spritesheets_args)),
+            ['check']
+        ),
+        stage(
+            'html',
+            data_inputs + [generate_html.__file__],
+            [os.path.join(generate_html.dest_dir, 'index.html')],
+            lambda model: generate_html.generate(model.groups(), model.types(), generate_html.parse_args([])),
+            ['check']
+        ),
+        stage(
+            'markdown',
+            data_inputs + [generate_markdown.__file__],
+            [os.path.join(generate_markdown.dest_dir, 'pokemon.md')],
+            lambda model: generate_markdown.generate(model.groups(), model.types()),
+            ['check']
+        ),
+        stage(
+            'mermaid',
+            data_inputs + [generate_mermaid.__file__],
+            [os.path.join(generate_mermaid.dest_dir, 'full.mermaid')],
+            lambda model: generate_mermaid.generate(pkmn_evolutions(model.index())),
+            ['check']
+        ),
+        stage(
+            'sqlite',
+            data_inputs + [generate_sqlite.__file__],
+            [os.path.join(generate_sqlite.dest_dir, generate_sqlite.database_name)],
+            lambda model: generate_sqlite.generate(model.groups(), model.type_data(), force),
+            ['check']
+        ),
+        stage(
+            'snapshot',
+            data_inputs + [generate_snapshot.__file__],
+            [pokemon_data.snapshot_path],
+            lambda model: generate_snapshot.generate(model.groups(), model.type_data(), force),
+            ['check']
+        )
+    ]
+
+
+def run_stages(stages: list[stage], model: pipeline_model, force: bool) -> bool :
+    # Stages are submitted in dependency order, so a stage only ever waits for stages that already started
+    futures: dict[str, Future] = {}
+
+    def run(current: stage) -> bool :
+        token = current_stage.set(current.name)
+        try:
+            return run_stage(current)
+        finally:
+            current_stage.reset(token)
+
+    def run_stage(current: stage) -> bool :
+        for name in current.requires :
+            if name in futures and not futures[name].result() :
+                print(f"skipped, stage {name} failed")
+                return False
+        if not force and current.is_up_to_date() :
+            print('up to date')
+            return True
+        print('started')
+        start = time.perf_counter()
+        try:
+            with instrumented_stage(current.name):
+                res = current.run(model)
+        except group_validation_error as e:
+            logger = check.error_logger()
+            check.report_validation_errors(e, logger)
+            res = 1
+        except Exception as e:
+            print(f"{type(e).__name__}: {e}")
+            res = 1
+        if res not in [None, 0] :
+            print('failed')
+            return False
+        current.mark_done()
+        print(f"done in {time.perf_counter() - start:.2f}s")
+        return True
+
+    with ThreadPoolExecutor(max(1, len(stages))) as pool, contextlib.redirect_stdout(stage_output(sys.stdout)):
+        for current in stages :
+            futures[current.name] = pool.submit(run, current)
+        return all(x.result() for x in futures.values())
+
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Loads the data once and runs the checks and all the generators on it')
+    parser.add_argument('stages', nargs='*', help='stages to run, along with the stages they require (default: all)')
+    parser.add_argument('--force', action='store_true', help='run the stages even if their outputs are up to date')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes used for validation and sprite decoding, 0 to use all cores (default: 1)')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    instrumentation.configure(args)
+
+    stages = make_stages(jobs, args.force)
+    by_name = { x.name: x for x in stages }
+    for name in args.stages :
+        if name not in by_name :
+            parser.error(f"unknown stage {name} (available: {', '.join(by_name.keys())})")
+    if len(args.stages) > 0 :
+        selected = set(args.stages)
+        for current in reversed(stages) :
+            if current.name in selected :
+                selected.update(current.requires)
+        stages = [x for x in stages if x.name in selected]
+
+    start = time.perf_counter()
+    ok = run_stages(stages, pipeline_model(jobs), args.force)
+    print(f"Pipeline {'completed' if ok else 'failed'} in {time.perf_counter() - start:.2f}s")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,107 @@
 
 import os
+import sys
 import json
+import math
+import mmap
+import struct
+import hashlib
+import tempfile
+import contextlib
+import unicodedata
 
 from enum import Enum
+from typing import Iterable, Iterator
 from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 import jsonschema
 from referencing import Registry, Resource
 from referencing.exceptions import NoSuchResource
 
+from instrumentation import count_file, open_file, stage
+
+
+json_delimiters = ' \t\n\r,]'
+
+# Temporary files are created private, outputs get the usual permissions once replaced
+file_umask = os.umask(0)
+os.umask(file_umask)
 
 def load_json(path: str):
-    with open(path, 'r') as f:
+    with open_file(path, 'r') as f:
         return json.load(f)
 
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w'):
+    # Written to a unique temporary file next to the destination, which only replaces it once complete,
+    # so a failure (e.g. an invalid group in a stream) or a concurrent run never leaves a partial file
+    directory = os.path.dirname(path)
+    count_file(mode)
+    f = tempfile.NamedTemporaryFile(mode, dir=directory if directory != '' else '.', prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+    try:
+        with f:
+            yield f
+        os.chmod(f.name, 0o666 & ~file_umask)
+        os.replace(f.name, path)
+    except BaseException:
+        os.remove(f.name)
+        raise
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16):
+    # Yields the items of a top-level JSON array one at a time,
+    # only keeping the current item and a chunk of the file in memory
+    decoder = json.JSONDecoder()
+    with open_file(path, 'r') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def fill() -> bool :
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = len(chunk) == 0
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return not eof
+
+        def next_char() -> str :
+            nonlocal pos
+            while True :
+                while pos < len(buffer) and buffer[pos].isspace() :
+                    pos += 1
+                if pos < len(buffer) :
+                    return buffer[pos]
+                if not fill() :
+                    raise json.JSONDecodeError('Unexpected end of file', buffer, pos)
+
+        if next_char() != '[' :
+            raise json.JSONDecodeError('Expected a top-level array', buffer, pos)
+        pos += 1
+        if next_char() == ']' :
+            return
+        while True :
+            next_char()
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # A number might continue in the next chunk, it is only complete once followed by a delimiter
+                if (end == len(buffer) or buffer[end] not in json_delimiters) and not eof :
+                    # Positions are relative to the buffer, which moves even when nothing more is read
+                    fill()
+                    continue
+            except json.JSONDecodeError:
+                if eof or not fill() :
+                    raise
+                continue
+            pos = end
+            yield item
+            separator = next_char()
+            pos += 1
+            if separator == ']' :
+                return
+            if separator != ',' :
+                raise json.JSONDecodeError("Expected ',' or ']'", buffer, pos - 1)
+
 
 schemas_base_path = 'schemas'
 schemas_base_uri = 'schema://pokemon-icons.db/'
@@ -32,13 +120,109 @@ def retrieve_schema(uri: str):
 
 registry = Registry(retrieve=retrieve_schema)
 
+@lru_cache(maxsize=1)
+def schemas_registry() -> Registry :
+    # All the schemas are registered (and crawled) upfront, so that references never need to be retrieved
+    resources: list[Resource] = []
+    for dirpath, _, filenames in os.walk(schemas_base_path):
+        for filename in sorted(filenames):
+            if filename.endswith('.json') :
+                resources.append(Resource.from_contents(load_json(os.path.join(dirpath, filename))))
+    return registry.with_resources((x.id(), x) for x in resources).crawl()
 
-def load_validated_json(filename: str):
-    data = load_json(filename)
-    # TODO: this is not ideal (should fetch only once)
-    # but in practice we only load the data once, so it is sufficient
+@lru_cache(maxsize=None)
+def schema_validator(filename: str, definition: str | None = None):
+    # Compiled once per process, definition selects a sub-schema in $defs (e.g. a single group)
     schema = load_json(os.path.join(schemas_base_path, filename))
-    jsonschema.validate(data, schema, registry=registry)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    if definition is not None :
+        schema = { '$schema': schema['$schema'], '$ref': f"{schema['$id']}#/$defs/{definition}" }
+    return validator_class(schema, registry=schemas_registry(), format_checker=validator_class.FORMAT_CHECKER)
+
+
+cache_dir = '.cache'
+validation_cache_path = os.path.join(cache_dir, 'validated.json')
+
+def schemas_digest() -> str :
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(schemas_base_path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            digest.update(path.encode())
+            with open_file(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def load_validation_cache() -> dict[str, str] :
+    try:
+        return load_json(validation_cache_path)
+    except (OSError, ValueError):
+        return {}
+
+def store_validation_cache(cache: dict[str, str]):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Concurrent runs each write their own temporary file, the last one to be replaced wins
+    with atomic_write(validation_cache_path) as f:
+        json.dump(cache, f, indent=4)
+
+class group_validation_error(ValueError):
+    def __init__(self, errors: list[tuple[int, int | None, list[str]]]):
+        # Index in the list, group number (if any) and error messages for each invalid group
+        self.errors = errors
+        count = sum(len(x[2]) for x in errors)
+        idx, number, messages = errors[0]
+        where = f"group {number}" if number is not None else f"group at index {idx}"
+        super().__init__(f"{count} error(s) in {len(errors)} group(s), first in {where}: {messages[0]}")
+
+def group_errors(chunk: list[tuple[int, object]]) -> list[tuple[int, int | None, list[str]]] :
+    validator = schema_validator('pokemon.json', 'group')
+    res = []
+    for idx, data in chunk :
+        messages = [f"{x.json_path}: {x.message}" for x in validator.iter_errors(data)]
+        if len(messages) > 0 :
+            number = data.get('number') if isinstance(data, dict) else None
+            res.append((idx, number if isinstance(number, int) else None, messages))
+    return res
+
+def validate_groups(groups: list, jobs: int = 1):
+    # Each group is validated on its own, with jobs > 1 the list is split across a process pool
+    items = list(enumerate(groups))
+    if jobs <= 1 :
+        errors = group_errors(items)
+    else:
+        chunk_size = max(1, math.ceil(len(items) / (jobs * 4)))
+        chunks = [items[i:i+chunk_size] for i in range(0, len(items), chunk_size)]
+        with ProcessPoolExecutor(jobs) as pool:
+            errors = [x for res in pool.map(group_errors, chunks) for x in res]
+    if len(errors) > 0 :
+        raise group_validation_error(errors)
+
+def validation_key(data_digest: str) -> str :
+    # The key covers the data and every schema, since any of them can change the validation outcome
+    return data_digest + ':' + schemas_digest()
+
+def load_validated_json(filename: str, use_cache: bool = True, jobs: int = 1):
+    with stage('read'):
+        with open_file(filename, 'rb') as f:
+            raw = f.read()
+    with stage('parse'):
+        data = json.loads(raw)
+    with stage('digest'):
+        key = validation_key(hashlib.sha256(raw).hexdigest())
+        cache = load_validation_cache() if use_cache else {}
+    if cache.get(filename) == key :
+        return data
+    with stage('validate'):
+        if filename == 'pokemon.json' and isinstance(data, list) :
+            # The document is a plain list of groups, validating them one by one is equivalent
+            validate_groups(data, jobs)
+        else:
+            schema_validator(filename).validate(data)
+    if use_cache :
+        cache[filename] = key
+        store_validation_cache(cache)
     return data
 
 
@@ -55,29 +239,89 @@ class pkmn_gender_ratio(Enum):
     def is_mixed(self) -> bool :
         return self not in [ pkmn_gender_ratio.MALE_ONLY, pkmn_gender_ratio.FEMALE_ONLY, pkmn_gender_ratio.UNGENDERED ]
 
+# Strings repeated across many forms are interned, and wiki links are stored as a suffix
+# relative to a shared prefix, so that the in-memory model stays compact
+link_prefixes: list[str] = []
+link_prefix_ids: dict[str, int] = {}
+
+class frozen_list(list):
+    # Identical lists are shared between forms, so they behave like the lists of the JSON data but cannot be modified
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object is immutable")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+
+    def __hash__(self) -> int :
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return frozen_list, (list(self),)
+
+interned_lists: dict[tuple[str | None, ...], frozen_list] = {}
+
+def intern_variant(variant: str | None) -> str | None :
+    return sys.intern(variant) if variant is not None else None
+
+def intern_list(values: list[str | None]) -> frozen_list :
+    key = tuple(intern_variant(x) for x in values)
+    res = interned_lists.get(key)
+    if res is None :
+        res = frozen_list(key)
+        interned_lists[key] = res
+    return res
+
+def split_link(url: str) -> tuple[int, str] :
+    cut = url.rfind('/') + 1
+    prefix = url[:cut]
+    prefix_id = link_prefix_ids.get(prefix)
+    if prefix_id is None :
+        prefix_id = len(link_prefixes)
+        link_prefixes.append(sys.intern(prefix))
+        link_prefix_ids[prefix] = prefix_id
+    return prefix_id, url[cut:]
+
 class pkmn_names:
+    __slots__ = ('fr', 'en')
+
     def __init__(self, data):
         self.fr: str = data['fr']
         self.en: str = data['en']
 
 class pkmn_links:
+    __slots__ = ('_bulbapedia_prefix', '_bulbapedia', '_pokepedia_prefix', '_pokepedia')
+
     def __init__(self, data):
-        self.bulbapedia: str = data['bulbapedia']
-        self.pokepedia: str = data['pokepedia']
+        self._bulbapedia_prefix, self._bulbapedia = split_link(data['bulbapedia'])
+        self._pokepedia_prefix, self._pokepedia = split_link(data['pokepedia'])
+
+    @property
+    def bulbapedia(self) -> str :
+        return link_prefixes[self._bulbapedia_prefix] + self._bulbapedia
+
+    @property
+    def pokepedia(self) -> str :
+        return link_prefixes[self._pokepedia_prefix] + self._pokepedia
 
 class pkmn_derivation:
+    __slots__ = ('from_variants', 'battle_only')
+
     def __init__(self, data):
-        self.from_variants: list[str | None] = data['from']
+        self.from_variants: frozen_list = intern_list(data['from'])
         self.battle_only: bool = data['battle_only']
 
 class pkmn_form:
+    __slots__ = ('names', 'links', 'types', 'gen', 'variant', 'evolution_variants', 'gender_variant', 'gender_ratio', 'derives')
+
     def __init__(self, data):
         self.names = pkmn_names(data['names'])
         self.links = pkmn_links(data['links'])
-        self.types: list[str] = data['types']
+        self.types: frozen_list = intern_list(data['types'])
         self.gen: int = data['gen']
-        self.variant: str | None = data['variant'] if 'variant' in data else None
-        self.evolution_variants: list[str] | None = data['evolution_variants'] if 'evolution_variants' in data else None
+        self.variant: str | None = intern_variant(data['variant']) if 'variant' in data else None
+        self.evolution_variants: frozen_list | None = intern_list(data['evolution_variants']) if 'evolution_variants' in data and data['evolution_variants'] is not None else None
         self.gender_variant: bool = data['gender_variant'] if 'gender_variant' in data else False
         self.gender_ratio = pkmn_gender_ratio(data['gender_ratio']) if 'gender_ratio' in data and data['gender_ratio'] is not None else None
         self.derives: pkmn_derivation | None = None
@@ -87,7 +331,11 @@ class pkmn_form:
     def is_temporary(self) -> bool :
         return self.derives is not None and self.derives.battle_only
 
+find_form_scan_limit = 8
+
 class pkmn_group:
+    __slots__ = ('number', 'common_names', 'evolves_from', 'forms', '_variants')
+
     def __init__(self, data):
         self.number: int = data['number']
         self.common_names: pkmn_names | None = None
@@ -95,11 +343,25 @@ class pkmn_group:
             self.common_names = pkmn_names(data['common_names'])
         self.evolves_from: int | None = data['evolves_from']
         self.forms: list[pkmn_form] = list(pkmn_form(x) for x in data['forms'])
+        # Most groups have 1 to 3 forms, which are scanned, only the large ones get a lookup table
+        # (pkmn_index.form is the constant-time lookup across all groups)
+        self._variants: dict[str | None, pkmn_form] | None = None
+        if len(self.forms) > find_form_scan_limit :
+            self._variants = {}
+            for form in self.forms :
+                self._variants.setdefault(form.variant, form)
     
     def find_form(self, variant: str | None) -> pkmn_form | None :
-        return next(filter(lambda x: x.variant == variant, self.forms), None)
+        if self._variants is not None :
+            return self._variants.get(variant)
+        for form in self.forms :
+            if form.variant == variant :
+                return form
+        return None
 
 class pkmn_type:
+    __slots__ = ('names', 'colour', 'strong_against', 'weak_against', 'ineffective_against')
+
     def __init__(self, data):
         self.names = pkmn_names(data['names'])
         self.colour: str = data['colour']
@@ -107,10 +369,630 @@ class pkmn_type:
         self.weak_against: list[str] = data['weak_against']
         self.ineffective_against: list[str] = data['ineffective_against']
 
-def load_groups() -> list[pkmn_group] :
-    data = load_validated_json('pokemon.json')
-    return list(pkmn_group(x) for x in data)
+class type_chart:
+    def __init__(self, types: dict[str, pkmn_type]):
+        self.type_ids: list[str] = list(types.keys())
+        self._ids: dict[str, int] = { x: i for i, x in enumerate(self.type_ids) }
+        # rows[attacker][defender], columns[defender][attacker]
+        rows = [[1.0] * len(self.type_ids) for _ in self.type_ids]
+        for attacker, type in types.items() :
+            row = rows[self._ids[attacker]]
+            for defender in type.strong_against :
+                row[self._ids[defender]] = 2.0
+            for defender in type.weak_against :
+                row[self._ids[defender]] = 0.5
+            for defender in type.ineffective_against :
+                row[self._ids[defender]] = 0.0
+        self.rows: tuple[tuple[float, ...], ...] = tuple(tuple(x) for x in rows)
+        self.columns: tuple[tuple[float, ...], ...] = tuple(zip(*self.rows))
+        self._defensive: dict[tuple[str, ...], tuple[float, ...]] = {}
+
+    def type_id(self, type: str) -> int :
+        return self._ids[type]
+
+    def multiplier(self, attacker: str, defender: str) -> float :
+        return self.rows[self._ids[attacker]][self._ids[defender]]
+
+    def defensive(self, types: Iterable[str]) -> tuple[float, ...] :
+        # Multiplier of every attacking type (in type_ids order) against the combination, cached per distinct combination
+        types = tuple(types)
+        res = self._defensive.get(types)
+        if res is None :
+            columns = [self.columns[self._ids[x]] for x in types]
+            res = columns[0]
+            for column in columns[1:] :
+                res = tuple(a * b for a, b in zip(res, column))
+            self._defensive[types] = res
+        return res
+
+    def defensive_batch(self, combinations: Iterable[Iterable[str]]) -> list[tuple[float, ...]] :
+        # Forms share interned type lists, so a batch only computes each distinct combination once
+        return [self.defensive(x) for x in combinations]
+
+    def form_multipliers(self, groups: Iterable[pkmn_group]) -> dict[tuple[int, str | None], tuple[float, ...]] :
+        res = {}
+        for group in groups :
+            for form, multipliers in zip(group.forms, self.defensive_batch(x.types for x in group.forms)) :
+                res.setdefault((group.number, form.variant), multipliers)
+        return res
+
+def load_groups(jobs: int = 1) -> list[pkmn_group] :
+    with stage('load_groups'):
+        data = load_validated_json('pokemon.json', jobs=jobs)
+        with stage('build'):
+            return list(pkmn_group(x) for x in data)
+
+def iter_groups(filename: str = 'pokemon.json', use_cache: bool = True):
+    # Streaming alternative to load_groups, each group is validated on its own as it is parsed
+    digest = hashlib.sha256()
+    with open_file(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    key = validation_key(digest.hexdigest())
+    cache = load_validation_cache() if use_cache else {}
+    validated = cache.get(filename) == key
+    validator = schema_validator(filename, 'group') if not validated else None
+    for idx, data in enumerate(iter_json_array(filename)) :
+        if validator is not None :
+            try:
+                validator.validate(data)
+            except jsonschema.ValidationError as e:
+                e.path.appendleft(idx)
+                raise
+        yield pkmn_group(data)
+    # All the groups are valid, which is equivalent to validating the whole document
+    if not validated and use_cache :
+        cache[filename] = key
+        store_validation_cache(cache)
 
 def load_types() -> dict[str, pkmn_type] :
-    data = load_validated_json('types.json')
-    return { type_id: pkmn_type(type_data) for type_id, type_data in data.items() }
+    with stage('load_types'):
+        data = load_validated_json('types.json')
+        return { type_id: pkmn_type(type_data) for type_id, type_data in data.items() }
+
+
+pkmn_entry = tuple[pkmn_group, pkmn_form]
+
+class pkmn_index:
+    def __init__(self, groups: list[pkmn_group]):
+        self.groups = groups
+        self._by_number: dict[int, pkmn_group] = {}
+        self._by_variant: dict[tuple[int, str | None], pkmn_form] = {}
+        self._by_name: dict[str, dict[str, list[pkmn_entry]]] = { 'en': {}, 'fr': {} }
+        self._by_type: dict[str, list[pkmn_entry]] = {}
+        self._by_gen: dict[int, list[pkmn_entry]] = {}
+        for group in groups :
+            # In case of duplicates, the first group wins (duplicates are reported by check.py)
+            if group.number in self._by_number :
+                continue
+            self._by_number[group.number] = group
+            if group.common_names is not None :
+                # Common names refer to the whole group, represented by its first form
+                self._add_names(group.common_names, (group, group.forms[0]))
+            for form in group.forms :
+                entry = (group, form)
+                self._by_variant.setdefault((group.number, form.variant), form)
+                self._add_names(form.names, entry)
+                for typ in form.types :
+                    self._by_type.setdefault(typ, []).append(entry)
+                self._by_gen.setdefault(form.gen, []).append(entry)
+
+    def _add_names(self, names: pkmn_names, entry: pkmn_entry):
+        for lang in self._by_name :
+            entries = self._by_name[lang].setdefault(getattr(names, lang), [])
+            if entry not in entries :
+                entries.append(entry)
+
+    def group(self, number: int) -> pkmn_group | None :
+        return self._by_number.get(number)
+
+    def form(self, number: int, variant: str | None) -> pkmn_form | None :
+        return self._by_variant.get((number, variant))
+
+    def find_name(self, name: str, lang: str = 'en') -> list[pkmn_entry] :
+        return self._by_name[lang].get(name, [])
+
+    def with_type(self, typ: str) -> list[pkmn_entry] :
+        return self._by_type.get(typ, [])
+
+    def from_gen(self, gen: int) -> list[pkmn_entry] :
+        return self._by_gen.get(gen, [])
+
+class evolution_cycle_error(ValueError):
+    def __init__(self, cycles: list[tuple[int, ...]]):
+        super().__init__('Evolution loops between groups ' + ', '.join(' -> '.join(str(y) for y in x) for x in cycles))
+        self.cycles = cycles
+
+class pkmn_evolutions:
+    def __init__(self, index: pkmn_index):
+        self.index = index
+        self.unknown: dict[int, int] = {} # group number, unknown pre-evolution number
+        self.cycles: list[tuple[int, ...]] = []
+        self._parents: dict[int, int] = {}
+        self._children: dict[int, list[int]] = {}
+        for group in index.groups :
+            if index.group(group.number) is not group or group.evolves_from is None :
+                continue
+            if index.group(group.evolves_from) is None :
+                self.unknown[group.number] = group.evolves_from
+                continue
+            self._parents[group.number] = group.evolves_from
+            self._children.setdefault(group.evolves_from, []).append(group.number)
+
+        # Families are labelled with a depth-first traversal from their base group: Y descends from X
+        # if and only if the interval of Y is nested in the interval of X
+        self._intervals: dict[int, tuple[int, int]] = {}
+        self._stages: dict[int, int] = {}
+        self._roots: dict[int, int] = {}
+        self._families: dict[int, tuple[int, ...]] = {}
+        counter = 0
+        for group in index.groups :
+            root = group.number
+            if root in self._parents or root in self._roots :
+                continue
+            family: list[int] = []
+            stack: list[tuple[int, int, bool]] = [(root, 0, False)]
+            while len(stack) > 0 :
+                number, depth, done = stack.pop()
+                if done :
+                    self._intervals[number] = (self._intervals[number][0], counter)
+                    continue
+                self._intervals[number] = (counter, counter)
+                counter += 1
+                self._stages[number] = depth
+                self._roots[number] = root
+                family.append(number)
+                stack.append((number, depth, True))
+                for child in reversed(self._children.get(number, [])) :
+                    stack.append((child, depth + 1, False))
+            self._families[root] = tuple(sorted(family))
+
+        # Since a group has at most one pre-evolution, the groups that cannot be reached from a base group are stuck in (or below) a loop
+        for group in index.groups :
+            if group.number in self._roots or index.group(group.number) is not group :
+                continue
+            path = [group.number]
+            while self._parents[path[-1]] not in path :
+                path.append(self._parents[path[-1]])
+            cycle = tuple(path[path.index(self._parents[path[-1]]):])
+            start = cycle.index(min(cycle))
+            cycle = cycle[start:] + cycle[:start]
+            if cycle not in self.cycles :
+                self.cycles.append(cycle)
+            for number in path :
+                self._roots.setdefault(number, number)
+
+    def parent(self, number: int) -> int | None :
+        return self._parents.get(number)
+
+    def children(self, number: int) -> list[int] :
+        return self._children.get(number, [])
+
+    def is_ancestor(self, ancestor: int, number: int) -> bool :
+        outer = self._intervals.get(ancestor)
+        inner = self._intervals.get(number)
+        if outer is None or inner is None or ancestor == number :
+            return False
+        return outer[0] <= inner[0] and inner[1] <= outer[1]
+
+    def root(self, number: int) -> int | None :
+        return self._roots.get(number)
+
+    def family(self, number: int) -> tuple[int, ...] :
+        return self._families.get(self._roots.get(number), ())
+
+    def stage(self, number: int) -> int | None :
+        # 0 for base groups, 1 for their evolutions and so on, None for groups stuck in a loop
+        return self._stages.get(number)
+
+    def pre_evolution_variants(self, group: pkmn_group, form: pkmn_form) -> list[str | None] :
+        # Forms evolve from their evolution variants if any, otherwise from the same variant or else from the default variant
+        pre_number = self._parents.get(group.number)
+        if pre_number is None or self.index.group(pre_number) is None :
+            return []
+        if form.evolution_variants is not None :
+            return [x for x in form.evolution_variants if self.index.form(pre_number, x) is not None]
+        if self.index.form(pre_number, form.variant) is not None :
+            return [form.variant]
+        if self.index.form(pre_number, None) is not None :
+            return [None]
+        return []
+
+def load_evolutions() -> pkmn_evolutions :
+    res = pkmn_evolutions(load_index())
+    if len(res.cycles) > 0 :
+        raise evolution_cycle_error(res.cycles)
+    return res
+
+def load_type_chart() -> type_chart :
+    return type_chart(load_types())
+
+def load_index() -> pkmn_index :
+    return pkmn_index(load_groups())
+
+
+def normalize_name(name: str) -> str :
+    # Accents and case are dropped, punctuation becomes a word separator (e.g. "Mr. Mime" -> "mr mime")
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    chars = (x if x.isalnum() else ' ' for x in decomposed if not unicodedata.combining(x))
+    return ' '.join(''.join(chars).split())
+
+def name_trigrams(name: str) -> set[str] :
+    padded = f"  {name} "
+    return { padded[i:i+3] for i in range(len(padded) - 2) }
+
+def bounded_distance(a: str, b: str, max_distance: int) -> int :
+    # Levenshtein distance, giving up as soon as it is known to exceed max_distance
+    if abs(len(a) - len(b)) > max_distance :
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1) :
+        current = [i]
+        for j, cb in enumerate(b, start=1) :
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (ca != cb)))
+        if min(current) > max_distance :
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+pkmn_key = tuple[int, str | None]
+
+class pkmn_search_index:
+    max_prefix_results = 32
+    _ids_key = ''
+
+    def __init__(self, groups: list[pkmn_group]):
+        # Every (number, variant) gets an id in Pokédex order, which is also the order of the results
+        self.keys: list[pkmn_key] = []
+        self._names: list[tuple[str, int]] = []
+        self._name_trie: dict = {}
+        self._word_trie: dict = {}
+        self._trigrams: dict[str, list[int]] = {}
+        seen: set[int] = set()
+        for group in groups :
+            if group.number in seen :
+                continue
+            seen.add(group.number)
+            for form in group.forms :
+                entry_id = len(self.keys)
+                self.keys.append((group.number, form.variant))
+                names = [form.names.en, form.names.fr]
+                if form is group.forms[0] and group.common_names is not None :
+                    names.extend([group.common_names.en, group.common_names.fr])
+                for name in dict.fromkeys(normalize_name(x) for x in names) :
+                    self._add_name(name, entry_id)
+
+    def _add_name(self, name: str, entry_id: int):
+        name_id = len(self._names)
+        self._names.append((name, entry_id))
+        self._insert(self._name_trie, name, entry_id)
+        words = name.split(' ')
+        for i in range(1, len(words)) :
+            self._insert(self._word_trie, ' '.join(words[i:]), entry_id)
+        for trigram in name_trigrams(name) :
+            self._trigrams.setdefault(trigram, []).append(name_id)
+
+    def _insert(self, trie: dict, key: str, entry_id: int):
+        # Each node keeps the first ids of its subtree, so a prefix query is a single walk down the trie
+        node = trie
+        for char in key :
+            node = node.setdefault(char, {})
+            ids = node.setdefault(self._ids_key, [])
+            if len(ids) < self.max_prefix_results and (len(ids) == 0 or ids[-1] != entry_id) :
+                ids.append(entry_id)
+
+    def _walk(self, trie: dict, key: str) -> list[int] :
+        node = trie
+        for char in key :
+            node = node.get(char)
+            if node is None :
+                return []
+        return node.get(self._ids_key, [])
+
+    def prefix(self, query: str, limit: int = 10) -> list[pkmn_key] :
+        key = normalize_name(query)
+        if len(key) == 0 :
+            return []
+        # Names starting with the query come first, then names with a later word starting with it
+        ids = list(dict.fromkeys(self._walk(self._name_trie, key) + self._walk(self._word_trie, key)))
+        return [self.keys[x] for x in ids[:limit]]
+
+    def fuzzy(self, query: str, max_distance: int = 2, limit: int = 10) -> list[pkmn_key] :
+        key = normalize_name(query)
+        if len(key) == 0 :
+            return []
+        trigrams = name_trigrams(key)
+        counts: dict[int, int] = {}
+        for trigram in trigrams :
+            for name_id in self._trigrams.get(trigram, []) :
+                counts[name_id] = counts.get(name_id, 0) + 1
+        # A single edit changes at most 3 trigrams, which bounds the trigrams shared with any close enough name
+        min_shared = len(trigrams) - 3 * max_distance
+        best: dict[int, int] = {}
+        for name_id, shared in counts.items() :
+            if shared < min_shared :
+                continue
+            name, entry_id = self._names[name_id]
+            distance = bounded_distance(key, name, max_distance)
+            if distance <= max_distance and distance < best.get(entry_id, max_distance + 1) :
+                best[entry_id] = distance
+        ranked = sorted(best.items(), key=lambda x: (x[1], x[0]))
+        return [self.keys[x] for x, _ in ranked[:limit]]
+
+    def search(self, query: str, limit: int = 10) -> list[pkmn_key] :
+        res = self.prefix(query, limit)
+        if len(res) < limit :
+            res.extend(x for x in self.fuzzy(query, limit=limit) if x not in res)
+        return res[:limit]
+
+def load_search_index() -> pkmn_search_index :
+    return pkmn_search_index(load_groups())
+
+
+# Flat binary snapshot written by generate_snapshot.py, memory-mapped so that processes share its pages
+# through the page cache. Strings are stored once in a table, lists of strings (types, variants) in a list
+# table, and groups, forms and types as fixed-width records referring to them by index. All integers are
+# little-endian, offsets are relative to the start of the file.
+snapshot_path = os.path.join('generated', 'pokemon.snapshot')
+snapshot_magic = b'PKMNSNAP'
+snapshot_version = 1
+snapshot_none = 0xFFFFFFFF
+
+# magic, version, source digest, then (count, position) of the strings, string data, lists, list items, groups, group index, forms and types
+snapshot_header = struct.Struct('<8sI32s16I')
+snapshot_offset = struct.Struct('<I')
+snapshot_range = struct.Struct('<II')
+# number, evolves_from (0 if none), common names (fr, en), first form, form count
+snapshot_group_record = struct.Struct('<IIIIII')
+# names (fr, en), links (bulbapedia prefix and suffix, pokepedia prefix and suffix), types, variant,
+# evolution variants, derivation variants, gen, gender variant, gender ratio (0 if none), derivation (0 if none, 1 if permanent, 2 if battle only)
+snapshot_form_record = struct.Struct('<IIIIIIIIIIBBBB')
+# id, names (fr, en), colour, strong against, weak against, ineffective against
+snapshot_type_record = struct.Struct('<IIIIIII')
+
+snapshot_gender_ratios: list[pkmn_gender_ratio] = list(pkmn_gender_ratio)
+
+class snapshot_format_error(ValueError):
+    pass
+
+class snapshot_names:
+    __slots__ = ('_snapshot', '_fr', '_en')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', fr: int, en: int):
+        self._snapshot = snapshot
+        self._fr = fr
+        self._en = en
+
+    @property
+    def fr(self) -> str :
+        return self._snapshot.string(self._fr)
+
+    @property
+    def en(self) -> str :
+        return self._snapshot.string(self._en)
+
+class snapshot_links:
+    __slots__ = ('_snapshot', '_ids')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', ids: tuple[int, int, int, int]):
+        self._snapshot = snapshot
+        self._ids = ids
+
+    @property
+    def bulbapedia(self) -> str :
+        return self._snapshot.string(self._ids[0]) + self._snapshot.string(self._ids[1])
+
+    @property
+    def pokepedia(self) -> str :
+        return self._snapshot.string(self._ids[2]) + self._snapshot.string(self._ids[3])
+
+class snapshot_derivation:
+    __slots__ = ('_snapshot', '_from', 'battle_only')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', from_list: int, battle_only: bool):
+        self._snapshot = snapshot
+        self._from = from_list
+        self.battle_only = battle_only
+
+    @property
+    def from_variants(self) -> frozen_list :
+        return self._snapshot.string_list(self._from)
+
+class snapshot_form:
+    # Read-only view with the attributes of pkmn_form, fields are decoded from the mapping on access
+    __slots__ = ('_snapshot', '_record')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', record: tuple):
+        self._snapshot = snapshot
+        self._record = record
+
+    @property
+    def names(self) -> snapshot_names :
+        return snapshot_names(self._snapshot, self._record[0], self._record[1])
+
+    @property
+    def links(self) -> snapshot_links :
+        return snapshot_links(self._snapshot, self._record[2:6])
+
+    @property
+    def types(self) -> frozen_list :
+        return self._snapshot.string_list(self._record[6])
+
+    @property
+    def variant(self) -> str | None :
+        return self._snapshot.string(self._record[7])
+
+    @property
+    def evolution_variants(self) -> frozen_list | None :
+        return self._snapshot.string_list(self._record[8])
+
+    @property
+    def gen(self) -> int :
+        return self._record[10]
+
+    @property
+    def gender_variant(self) -> bool :
+        return self._record[11] != 0
+
+    @property
+    def gender_ratio(self) -> pkmn_gender_ratio | None :
+        return snapshot_gender_ratios[self._record[12] - 1] if self._record[12] != 0 else None
+
+    @property
+    def derives(self) -> snapshot_derivation | None :
+        if self._record[13] == 0 :
+            return None
+        return snapshot_derivation(self._snapshot, self._record[9], self._record[13] == 2)
+
+    def is_temporary(self) -> bool :
+        return self._record[13] == 2
+
+class snapshot_group:
+    # Read-only view with the attributes of pkmn_group, the forms are only read once
+    __slots__ = ('_snapshot', '_record', '_forms')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', record: tuple):
+        self._snapshot = snapshot
+        self._record = record
+        self._forms: tuple[snapshot_form, ...] | None = None
+
+    @property
+    def number(self) -> int :
+        return self._record[0]
+
+    @property
+    def evolves_from(self) -> int | None :
+        return self._record[1] if self._record[1] != 0 else None
+
+    @property
+    def common_names(self) -> snapshot_names | None :
+        if self._record[2] == snapshot_none :
+            return None
+        return snapshot_names(self._snapshot, self._record[2], self._record[3])
+
+    @property
+    def forms(self) -> tuple[snapshot_form, ...] :
+        if self._forms is None :
+            self._forms = tuple(self._snapshot.form_at(x) for x in range(self._record[4], self._record[4] + self._record[5]))
+        return self._forms
+
+    def find_form(self, variant: str | None) -> snapshot_form | None :
+        return next((x for x in self.forms if x.variant == variant), None)
+
+class snapshot_type:
+    __slots__ = ('_snapshot', '_record')
+
+    def __init__(self, snapshot: 'pkmn_snapshot', record: tuple):
+        self._snapshot = snapshot
+        self._record = record
+
+    @property
+    def names(self) -> snapshot_names :
+        return snapshot_names(self._snapshot, self._record[1], self._record[2])
+
+    @property
+    def colour(self) -> str :
+        return self._snapshot.string(self._record[3])
+
+    @property
+    def strong_against(self) -> list[str] :
+        return list(self._snapshot.string_list(self._record[4]))
+
+    @property
+    def weak_against(self) -> list[str] :
+        return list(self._snapshot.string_list(self._record[5]))
+
+    @property
+    def ineffective_against(self) -> list[str] :
+        return list(self._snapshot.string_list(self._record[6]))
+
+class pkmn_snapshot:
+    def __init__(self, path: str = snapshot_path):
+        self.path = path
+        with open_file(path, 'rb') as f:
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise snapshot_format_error(f"Snapshot at {path} is empty")
+        if len(self._data) < snapshot_header.size :
+            raise snapshot_format_error(f"Snapshot at {path} is truncated")
+        header = snapshot_header.unpack_from(self._data, 0)
+        if header[0] != snapshot_magic :
+            raise snapshot_format_error(f"{path} is not a snapshot")
+        if header[1] != snapshot_version :
+            raise snapshot_format_error(f"Snapshot at {path} has version {header[1]}, expected {snapshot_version}")
+        self.digest: str = header[2].hex()
+        (
+            self._string_count, self._strings_pos, _, self._string_data_pos,
+            self._list_count, self._lists_pos, _, self._list_items_pos,
+            self._group_count, self._groups_pos, _, self._group_index_pos,
+            self._form_count, self._forms_pos, self._type_count, self._types_pos
+        ) = header[3:]
+        end = max(self._types_pos + self._type_count * snapshot_type_record.size, self._forms_pos + self._form_count * snapshot_form_record.size)
+        if end > len(self._data) :
+            raise snapshot_format_error(f"Snapshot at {path} is truncated")
+        self._types: dict[str, snapshot_type] | None = None
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self) -> 'pkmn_snapshot' :
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def string(self, string_id: int) -> str | None :
+        if string_id == snapshot_none :
+            return None
+        start, end = snapshot_range.unpack_from(self._data, self._strings_pos + 4 * string_id)
+        return self._data[self._string_data_pos + start:self._string_data_pos + end].decode()
+
+    def string_list(self, list_id: int) -> frozen_list | None :
+        if list_id == snapshot_none :
+            return None
+        start, end = snapshot_range.unpack_from(self._data, self._lists_pos + 4 * list_id)
+        items = struct.unpack_from(f"<{end - start}I", self._data, self._list_items_pos + 4 * start)
+        return frozen_list(self.string(x) for x in items)
+
+    def form_at(self, idx: int) -> snapshot_form :
+        return snapshot_form(self, snapshot_form_record.unpack_from(self._data, self._forms_pos + idx * snapshot_form_record.size))
+
+    def group_at(self, idx: int) -> snapshot_group :
+        return snapshot_group(self, snapshot_group_record.unpack_from(self._data, self._groups_pos + idx * snapshot_group_record.size))
+
+    def __len__(self) -> int :
+        return self._group_count
+
+    def __iter__(self) -> Iterator[snapshot_group] :
+        return (self.group_at(x) for x in range(self._group_count))
+
+    def groups(self) -> list[snapshot_group] :
+        return list(self)
+
+    def group(self, number: int) -> snapshot_group | None :
+        # The index holds (number, position) pairs sorted by number, keeping the first group of each number
+        lo, hi = 0, self._group_count
+        while lo < hi :
+            mid = (lo + hi) // 2
+            mid_number, position = snapshot_range.unpack_from(self._data, self._group_index_pos + 8 * mid)
+            if mid_number == number :
+                return self.group_at(position)
+            if mid_number < number :
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def form(self, number: int, variant: str | None) -> snapshot_form | None :
+        group = self.group(number)
+        return group.find_form(variant) if group is not None else None
+
+    def types(self) -> dict[str, snapshot_type] :
+        if self._types is None :
+            records = (snapshot_type_record.unpack_from(self._data, self._types_pos + x * snapshot_type_record.size) for x in range(self._type_count))
+            self._types = { self.string(x[0]): snapshot_type(self, x) for x in records }
+        return self._types
+
+def load_snapshot(path: str = snapshot_path) -> pkmn_snapshot :
+    return pkmn_snapshot(path)
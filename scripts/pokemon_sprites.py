@@ -0,0 +1,193 @@
+
+import io
+import os
+import json
+
+from collections import OrderedDict
+
+from PIL import Image
+
+from instrumentation import count_file, open_file
+from pokemon_data import load_index, pkmn_form, pkmn_index
+
+
+sprites_base_dir = 'sprites'
+common_sprites_dir = os.path.join(sprites_base_dir, 'common/icons')
+shiny_sprites_dir = os.path.join(sprites_base_dir, 'shiny/icons')
+spritesheets_dir = os.path.join('generated', 'spritesheets')
+spritesheets_manifest_path = os.path.join(spritesheets_dir, 'manifest.json')
+
+sprite_key = tuple[int, str | None, bool, bool] # group number, variant, shiny, female
+
+
+def sprite_filename(number: int, variant: str | None, gender_variant: bool = False, female: bool = False) -> str :
+    name = f"{number:04d}"
+    if gender_variant :
+        name += '_f' if female else '_m'
+    if variant is not None :
+        name += f"_{variant}"
+    return f"{name}.png"
+
+def sprite_path(number: int, variant: str | None, shiny: bool, gender_variant: bool = False, female: bool = False) -> str :
+    return os.path.join(shiny_sprites_dir if shiny else common_sprites_dir, sprite_filename(number, variant, gender_variant, female))
+
+def file_version(path: str) -> tuple[int, int] | None :
+    # Modification time and size, which change whenever the file is regenerated
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def form_sprite_filenames(number: int, form: pkmn_form) -> list[str] :
+    if form.gender_variant :
+        return [sprite_filename(number, form.variant, True, True), sprite_filename(number, form.variant, True, False)]
+    return [sprite_filename(number, form.variant)]
+
+
+class bounded_cache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None :
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries :
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int] :
+        return { 'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses }
+
+
+class sprite_atlas:
+    # Sheet generated by generate_spritesheets.py, only decoded when a sprite is first cropped out of it
+    def __init__(self, path: str, sheet: dict):
+        self.path = path
+        self.sprite_size: tuple[int, int] = tuple(sheet['sprite_size'])
+        self.cells: dict[str, tuple[int, int]] = { x['path']: tuple(x['cell']) for x in sheet['cells'] }
+        # Sprites deduplicated into the cell of an identical sprite
+        self.cells.update((x, tuple(y)) for x, y in sheet.get('aliases', {}).items())
+        self._image: Image.Image | None = None
+
+    def crop(self, path: str) -> Image.Image | None :
+        cell = self.cells.get(path)
+        if cell is None :
+            return None
+        if self._image is None :
+            count_file('rb')
+            with Image.open(self.path) as im:
+                self._image = im.convert('RGBA')
+        left, top = cell[0] * self.sprite_size[0], cell[1] * self.sprite_size[1]
+        return self._image.crop((left, top, left + self.sprite_size[0], top + self.sprite_size[1]))
+
+class sprite_store:
+    def __init__(self, index: pkmn_index, use_atlas: bool = False, max_images: int = 512, max_encoded: int = 2048):
+        self.index = index
+        self.use_atlas = use_atlas
+        self.images = bounded_cache(max_images)
+        self.encoded = bounded_cache(max_encoded)
+        self._atlases: dict[bool, sprite_atlas | None] | None = None
+        self._manifest_version: tuple[int, int] | None = None
+
+    def _resolve(self, number: int, variant: str | None, shiny: bool, female: bool) -> tuple[sprite_key, str] | None :
+        # Forms without a gender variant use the same sprite for both genders
+        form = self.index.form(number, variant)
+        if form is None :
+            return None
+        female = female and form.gender_variant
+        return (number, variant, shiny, female), sprite_path(number, variant, shiny, form.gender_variant, female)
+
+    def resolve(self, number: int, variant: str | None = None, shiny: bool = False, female: bool = False) -> str | None :
+        resolved = self._resolve(number, variant, shiny, female)
+        return resolved[1] if resolved is not None else None
+
+    def _version(self, path: str) -> tuple :
+        if self.use_atlas :
+            return file_version(path), file_version(spritesheets_manifest_path)
+        return file_version(path),
+
+    def version(self, number: int, variant: str | None = None, shiny: bool = False, female: bool = False) -> tuple | None :
+        # Cached copies of a sprite are keyed on its sources, so that regenerated sprites or sheets are picked up
+        resolved = self._resolve(number, variant, shiny, female)
+        return self._version(resolved[1]) if resolved is not None else None
+
+    def _atlas(self, shiny: bool) -> sprite_atlas | None :
+        # The sheets are loaded again whenever the manifest changes
+        manifest_version = file_version(spritesheets_manifest_path)
+        if self._atlases is None or manifest_version != self._manifest_version :
+            self._atlases = { False: None, True: None }
+            self._manifest_version = manifest_version
+            if manifest_version is not None :
+                with open_file(spritesheets_manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                # Only the sheets of the format used by the last run are current
+                sheets = manifest['sheets']
+                image_format = manifest.get('format', 'png')
+                for shiny_sheet, name in [(False, 'common'), (True, 'shiny')] :
+                    sheet_name = next((x for x in sheets if os.path.splitext(x)[0] == name and sheets[x].get('format', 'png') == image_format), None)
+                    if sheet_name is not None :
+                        self._atlases[shiny_sheet] = sprite_atlas(os.path.join(spritesheets_dir, sheet_name), sheets[sheet_name])
+        return self._atlases[shiny]
+
+    def image(self, number: int, variant: str | None = None, shiny: bool = False, female: bool = False) -> Image.Image | None :
+        resolved = self._resolve(number, variant, shiny, female)
+        if resolved is None :
+            return None
+        key, path = resolved
+        key = (key, self._version(path))
+        res = self.images.get(key)
+        if res is not None :
+            return res
+        atlas = self._atlas(shiny) if self.use_atlas else None
+        res = atlas.crop(path) if atlas is not None else None
+        if res is None :
+            if not os.path.isfile(path) :
+                return None
+            count_file('rb')
+            with Image.open(path) as im:
+                res = im.convert('RGBA')
+        self.images.put(key, res)
+        return res
+
+    def png(self, number: int, variant: str | None = None, shiny: bool = False, female: bool = False) -> bytes | None :
+        resolved = self._resolve(number, variant, shiny, female)
+        if resolved is None :
+            return None
+        key, path = resolved
+        key = (key, self._version(path))
+        res = self.encoded.get(key)
+        if res is not None :
+            return res
+        if not self.use_atlas :
+            # Individual sprites are already PNG files, they are served as is
+            if not os.path.isfile(path) :
+                return None
+            with open_file(path, 'rb') as f:
+                res = f.read()
+        else:
+            im = self.image(number, variant, shiny, female)
+            if im is None :
+                return None
+            buffer = io.BytesIO()
+            im.save(buffer, format='PNG')
+            res = buffer.getvalue()
+        self.encoded.put(key, res)
+        return res
+
+    def stats(self) -> dict[str, dict[str, int]] :
+        return { 'images': self.images.stats(), 'encoded': self.encoded.stats() }
+
+def load_sprite_store(use_atlas: bool = False) -> sprite_store :
+    return sprite_store(load_index(), use_atlas)
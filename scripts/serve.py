@@ -0,0 +1,233 @@
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import hashlib
+import argparse
+
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from instrumentation import open_file, stage
+from pokemon_data import load_index
+from pokemon_sprites import bounded_cache, sprite_store, spritesheets_dir
+
+
+content_types = {
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json',
+    '.html': 'text/html; charset=utf-8'
+}
+
+status_reasons = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed'
+}
+
+max_header_size = 16384
+
+
+class response:
+    __slots__ = ('body', 'etag', 'content_type')
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.content_type = content_type
+
+class icon_server:
+    def __init__(self, store: sprite_store, max_age: int, max_cached: int):
+        self.store = store
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else 'no-cache'
+        # Hot responses along with their ETag, files are keyed with their modification time so that regenerated sheets are picked up
+        self.responses = bounded_cache(max_cached)
+        self.requests = 0
+        # Files are read and sprites encoded off the event loop, in a single thread since the store caches are not thread-safe
+        self.loader = ThreadPoolExecutor(1, thread_name_prefix='loader')
+        self.closing = False
+        self.handlers: set[asyncio.Task] = set()
+        self.idle: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def load(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.loader, fn, *args)
+
+    async def icon(self, path: str, query: dict[str, list[str]]) -> response | None :
+        name = path[len('/icons/'):]
+        if name.endswith('.png') :
+            name = name[:-len('.png')]
+        parts = name.split('/', 1)
+        if not parts[0].isdigit() :
+            return None
+        number = int(parts[0])
+        variant = parts[1] if len(parts) > 1 and len(parts[1]) > 0 else None
+        shiny = query.get('shiny', ['0'])[0] in ['1', 'true']
+        female = query.get('female', ['0'])[0] in ['1', 'true']
+        version = self.store.version(number, variant, shiny, female)
+        if version is None :
+            return None
+        key = ('icon', number, variant, shiny, female, version)
+        res = self.responses.get(key)
+        if res is None :
+            body = await self.load(self.store.png, number, variant, shiny, female)
+            if body is None :
+                return None
+            res = response(body, content_types['.png'])
+            self.responses.put(key, res)
+        return res
+
+    async def static(self, path: str) -> response | None :
+        relative = os.path.normpath(unquote(path[len('/spritesheets/'):]))
+        if relative.startswith('..') or os.path.isabs(relative) :
+            return None
+        filepath = os.path.join(spritesheets_dir, relative)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        content_type = content_types.get(os.path.splitext(filepath)[1])
+        if content_type is None or not os.path.isfile(filepath) :
+            return None
+        key = ('file', filepath, stat.st_mtime_ns, stat.st_size)
+        res = self.responses.get(key)
+        if res is None :
+            res = response(await self.load(read_file, filepath), content_type)
+            self.responses.put(key, res)
+        return res
+
+    async def route(self, target: str) -> response | None :
+        url = urlsplit(target)
+        if url.path.startswith('/icons/') :
+            return await self.icon(url.path, parse_qs(url.query))
+        if url.path.startswith('/spritesheets/') :
+            return await self.static(url.path)
+        if url.path == '/styles.css' :
+            return await self.static('/spritesheets/styles.css')
+        return None
+
+    async def respond(self, method: str, target: str, headers: dict[str, str]) -> tuple[int, list[tuple[str, str]], bytes] :
+        if method not in ['GET', 'HEAD'] :
+            return 405, [('Allow', 'GET, HEAD')], b''
+        res = await self.route(target)
+        if res is None :
+            return 404, [('Content-Type', 'text/plain; charset=utf-8')], b'Not found\n'
+        res_headers = [('ETag', res.etag), ('Cache-Control', self.cache_control)]
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None and (if_none_match.strip() == '*' or res.etag in [x.strip() for x in if_none_match.split(',')]) :
+            return 304, res_headers, b''
+        res_headers.append(('Content-Type', res.content_type))
+        return 200, res_headers, res.body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            while not self.closing :
+                self.idle[task] = writer
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                finally:
+                    del self.idle[task]
+                lines = head.decode('latin-1').split('\r\n')
+                request_line = lines[0].split(' ')
+                if len(request_line) != 3 :
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                method, target, version = request_line
+                headers: dict[str, str] = {}
+                for line in lines[1:] :
+                    if ':' in line :
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                # Request bodies are not used, but must be consumed to keep the connection usable
+                length = headers.get('content-length', '0')
+                if not length.isdigit() :
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                length = int(length)
+                if length > 0 :
+                    await reader.readexactly(length)
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+                self.requests += 1
+                status, res_headers, body = await self.respond(method, target, headers)
+                if status != 304 :
+                    res_headers.append(('Content-Length', str(len(body))))
+                if not keep_alive :
+                    res_headers.append(('Connection', 'close'))
+                head_lines = [f"HTTP/1.1 {status} {status_reasons[status]}"] + [f"{x}: {y}" for x, y in res_headers]
+                writer.write(("\r\n".join(head_lines) + "\r\n\r\n").encode('latin-1') + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive :
+                    break
+        finally:
+            self.handlers.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def close(self):
+        # Idle keep-alive connections are closed, the others once their current response is sent
+        self.closing = True
+        for writer in self.idle.values() :
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        self.loader.shutdown()
+
+
+def read_file(path: str) -> bytes :
+    with open_file(path, 'rb') as f:
+        return f.read()
+
+
+async def serve(server: icon_server, host: str, port: int):
+    listener = await asyncio.start_server(server.handle, host, port, limit=max_header_size)
+    print(f"Serving icons on http://{host}:{port}/icons/<number>[/<variant>][?shiny=1&female=1] and spritesheets on http://{host}:{port}/spritesheets/")
+    # Stopping the server (e.g. from the load test) lets the pending responses finish and main print the statistics
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM] :
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+    listener.close()
+    await server.close()
+    await listener.wait_closed()
+
+def main(argv: list[str] | None = None) -> int :
+    parser = argparse.ArgumentParser(description='Serves the icons, the spritesheets and their styles over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    parser.add_argument('--atlas', action='store_true', help='crop the icons out of the generated spritesheets instead of reading the individual files')
+    parser.add_argument('--max-age', type=int, default=0, help='max-age of the Cache-Control header in seconds, 0 to make clients revalidate with the ETag (default: 0)')
+    parser.add_argument('--cache-size', type=int, default=4096, help='maximum number of responses kept in memory (default: 4096)')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure(args)
+
+    # The data model is loaded once, requests only hit the in-memory caches
+    start = time.perf_counter()
+    with stage('load'):
+        store = sprite_store(load_index(), args.atlas)
+    print(f"Data loaded in {time.perf_counter() - start:.2f}s")
+    server = icon_server(store, args.max_age, args.cache_size)
+    asyncio.run(serve(server, args.host, args.port))
+    print(f"Served {server.requests} requests, cache: {server.responses.stats()}, sprites: {store.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from pokemon_data import pkmn_group, pkmn_index, pkmn_evolutions
+
+
+def group(number: int, evolves_from: int | None) -> pkmn_group :
+    name = f'pkmn{number}'
+    return pkmn_group({
+        'number': number,
+        'evolves_from': evolves_from,
+        'forms': [{
+            'names': { 'en': name, 'fr': name },
+            'links': {
+                'bulbapedia': f'https://bulbapedia.bulbagarden.net/wiki/{name}_(Pok%C3%A9mon)',
+                'pokepedia': f'https://www.pokepedia.fr/{name}'
+            },
+            'types': ['normal'],
+            'gen': 1,
+            'variant': None
+        }]
+    })
+
+def evolutions(*groups: tuple[int, int | None]) -> pkmn_evolutions :
+    return pkmn_evolutions(pkmn_index([group(number, evolves_from) for number, evolves_from in groups]))
+
+
+def test_chain():
+    evos = evolutions((1, None), (2, 1), (3, 2), (4, 1), (5, None))
+    assert evos.cycles == []
+    assert [evos.stage(x) for x in range(1, 6)] == [0, 1, 2, 1, 0]
+    assert evos.is_ancestor(1, 3)
+    assert evos.is_ancestor(2, 3)
+    assert not evos.is_ancestor(3, 1)
+    assert not evos.is_ancestor(4, 3)
+    assert not evos.is_ancestor(1, 1)
+    assert not evos.is_ancestor(1, 5)
+    assert evos.family(3) == (1, 2, 3, 4)
+    assert evos.root(4) == 1
+
+def test_self_loop():
+    # Porygon2 once evolved from itself in the data
+    evos = evolutions((137, None), (233, 233), (474, 233))
+    assert evos.cycles == [(233,)]
+    assert evos.stage(137) == 0
+    assert evos.stage(233) is None
+    assert evos.stage(474) is None
+    assert not evos.is_ancestor(233, 233)
+    assert not evos.is_ancestor(233, 474)
+    assert not evos.is_ancestor(137, 233)
+
+def test_loop():
+    evos = evolutions((3, 2), (1, 3), (2, 1), (4, 2))
+    assert evos.cycles == [(1, 3, 2)]
+    assert all(evos.stage(x) is None for x in range(1, 5))
@@ -0,0 +1,36 @@
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from pokemon_data import iter_json_array
+
+
+documents = [
+    '[]',
+    ' [ ] ',
+    '[1.5e10, 2]',
+    '[-12.25E-3,0,\n 7 ]',
+    '[true,false,null,1]',
+    '[{"number": 25, "types": ["electric"]}, "a,b]", [1, [2.5]], 3e2]'
+]
+
+@pytest.mark.parametrize('document', documents)
+def test_split_at_every_offset(tmp_path, document: str):
+    path = tmp_path / 'data.json'
+    path.write_text(document)
+    expected = json.loads(document)
+    for chunk_size in range(1, len(document) + 2) :
+        assert list(iter_json_array(str(path), chunk_size)) == expected, f"chunk_size={chunk_size}"
+
+@pytest.mark.parametrize('document', ['[1 2]', '[1,', '{"a": 1}', '[1.5e]'])
+def test_invalid(tmp_path, document: str):
+    path = tmp_path / 'data.json'
+    path.write_text(document)
+    for chunk_size in range(1, len(document) + 2) :
+        with pytest.raises(json.JSONDecodeError):
+            list(iter_json_array(str(path), chunk_size))